@@ -1,18 +1,83 @@
-from fastapi import FastAPI, HTTPException
-from fastapi.responses import HTMLResponse
+import asyncio
+import json
+import math
+import os
+import time
+import uuid
+from collections.abc import AsyncIterator
+from contextlib import asynccontextmanager
+from typing import Literal
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import HTMLResponse, Response, StreamingResponse
 from pydantic import BaseModel
-import qrcode
-import io
-import base64
-from rozo import create_rozo_payment, load_service_config, fetch_merchants, MerchantDict
-from lendasat import create_ln_payment_for_rozo
+from rozo import (
+    merchant_snapshot_file,
+    fx_rates,
+    merchant_directory,
+    MERCHANTS_KEY,
+    has_service,
+    merchant_label,
+)
+from cache import CacheStatsDict, CoalescingStatsDict, LruStatsDict
+from invoices import (
+    find_invoice,
+    issue_invoice_once,
+    issued_invoices,
+    invoice_requests,
+    quote_invoice,
+    IdempotencyKeyReusedError,
+    InvoiceDict,
+    ProgressCallback,
+    QuoteDict,
+)
+from tracker import status_tracker, TrackerStatsDict
+from metrics import observe_stage, render as render_metrics, CONTENT_TYPE
+from journal import swap_journal, JournalStatsDict
+from lendasat import InvoiceMismatchError
+from shared_cache import shared_store, SharedStoreStatsDict
+from qr import qr_renderer, qr_image, qr_images, MEDIA_TYPES
+from static import StaticAsset, etag_matches
+from resilience import upstream_stats, UpstreamUnavailableError, UpstreamStatsDict
+from ratelimit import rate_limiter, RateLimiterStatsDict
+from deadline import (
+    deadline,
+    stage_deadline,
+    DeadlineExceededError,
+    DEADLINE_HEADER,
+    INVOICE_DEADLINE,
+    INVOICE_DEADLINE_MAX,
+)
+from tracing import tracer, TraceDict, TracingStatsDict
+from http_client import create_client, close_client, pool_stats, HostPoolStatsDict
 
-app = FastAPI()
+BATCH_MAX_ITEMS = int(os.getenv("BATCH_MAX_ITEMS", "100"))
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", "8"))
 
 
-@app.on_event("startup")
-async def startup_event() -> None:
-    await load_service_config()
+@asynccontextmanager
+async def lifespan(app: FastAPI) -> AsyncIterator[None]:
+    create_client()
+    qr_renderer.start()
+    swap_journal.open()
+    shared_store.open()
+    try:
+        merchant_snapshot_file.restore()
+        merchant_directory.start([MERCHANTS_KEY])
+        fx_rates.start(["USD"])
+        status_tracker.start()
+        yield
+    finally:
+        await status_tracker.stop()
+        await fx_rates.stop()
+        await merchant_directory.stop()
+        await close_client()
+        qr_renderer.shutdown()
+        swap_journal.close()
+        shared_store.close()
+        tracer.close()
+
+
+app = FastAPI(lifespan=lifespan)
 
 
 class PaymentRequest(BaseModel):
@@ -20,14 +85,121 @@ class PaymentRequest(BaseModel):
     service: str
 
 
+def sse_event(event: str, data: object) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
 @app.get("/api/merchants")
-async def get_merchants() -> list[MerchantDict]:
-    return await fetch_merchants()
+async def get_merchants(request: Request) -> Response:
+    try:
+        snapshot = await merchant_directory.get(MERCHANTS_KEY)
+    except Exception as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    headers = {"ETag": snapshot["etag"], "Cache-Control": "no-cache"}
+    if etag_matches(request, snapshot["etag"]):
+        return Response(status_code=304, headers=headers)
+    return Response(snapshot["body"], media_type="application/json", headers=headers)
 
 
-@app.get("/", response_class=HTMLResponse)
-async def home() -> str:
-    return """
+@app.get("/metrics")
+async def get_metrics() -> Response:
+    return Response(render_metrics(), media_type=CONTENT_TYPE)
+
+
+@app.get("/debug/pool")
+async def get_pool_stats() -> dict[str, HostPoolStatsDict]:
+    return pool_stats()
+
+
+@app.get("/debug/upstreams")
+async def get_upstream_stats() -> dict[str, UpstreamStatsDict]:
+    return upstream_stats()
+
+
+@app.get("/debug/cache")
+async def get_cache_stats() -> dict[str, CacheStatsDict]:
+    return {"merchants": merchant_directory.stats(), "fx_rates": fx_rates.stats()}
+
+
+@app.get("/debug/ratelimit")
+async def get_rate_limit_stats() -> RateLimiterStatsDict:
+    return rate_limiter.stats()
+
+
+@app.get("/debug/shared")
+async def get_shared_stats() -> SharedStoreStatsDict:
+    return shared_store.stats()
+
+
+@app.get("/debug/lru")
+async def get_lru_stats() -> dict[str, LruStatsDict]:
+    return {"invoices": issued_invoices.stats(), "qr_images": qr_images.stats()}
+
+
+@app.get("/debug/idempotency")
+async def get_idempotency_stats() -> CoalescingStatsDict:
+    return invoice_requests.stats()
+
+
+@app.get("/debug/journal")
+async def get_journal_stats() -> JournalStatsDict:
+    return swap_journal.stats()
+
+
+@app.get("/debug/tracker")
+async def get_tracker_stats() -> TrackerStatsDict:
+    return status_tracker.stats()
+
+
+@app.get("/debug/traces")
+async def get_traces(limit: int = 20, name: str | None = None) -> list[TraceDict]:
+    return tracer.slowest(limit, name)
+
+
+@app.get("/debug/traces/stats")
+async def get_trace_stats() -> TracingStatsDict:
+    return tracer.stats()
+
+
+@app.get("/api/invoices/{invoice_id}/events")
+async def invoice_events(invoice_id: str) -> StreamingResponse:
+    invoice = await find_invoice(invoice_id)
+    if invoice is None:
+        raise HTTPException(status_code=404, detail="Unknown invoice")
+
+    async def stream() -> AsyncIterator[str]:
+        async for status in status_tracker.subscribe(
+            invoice_id, invoice["rozo_payment_id"], invoice["expires_at"]
+        ):
+            if status is None:
+                yield ": keep-alive\n\n"
+            else:
+                yield sse_event("status", status)
+
+    return StreamingResponse(
+        stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@app.get("/api/quote")
+async def get_quote(service: str, amount: float) -> QuoteDict:
+    try:
+        known = await has_service(service)
+    except Exception as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    if not known:
+        raise HTTPException(status_code=404, detail="Unknown service")
+    if amount <= 0:
+        raise HTTPException(status_code=422, detail="Amount must be positive")
+    quote = await quote_invoice(service, amount)
+    if quote is None:
+        raise HTTPException(status_code=503, detail="No recent swap price available")
+    return quote
+
+
+HOME_HTML = """
 <!DOCTYPE html>
 <html>
 <head>
@@ -156,6 +328,12 @@ async def home() -> str:
         .amount-input-wrapper input::placeholder {
             color: #555;
         }
+        .quote {
+            margin-top: 8px;
+            min-height: 18px;
+            color: #999;
+            font-size: 14px;
+        }
         .currency-label {
             position: absolute;
             right: 16px;
@@ -206,6 +384,12 @@ async def home() -> str:
             display: block;
             margin: 0 auto;
         }
+        .payment-status {
+            text-align: center;
+            color: #999;
+            font-size: 14px;
+            margin-bottom: 16px;
+        }
         .invoice-box { 
             background: #242424;
             border: 1px solid #333;
@@ -371,6 +555,7 @@ async def home() -> str:
                     <input type="number" id="amount" step="0.01" min="0.01" placeholder="0.00" required>
                     <span class="currency-label" id="currencyLabel">RM</span>
                 </div>
+                <div class="quote" id="quote"></div>
             </div>
             <button type="submit" id="submitBtn">⚡ Pay Now</button>
         </form>
@@ -379,6 +564,7 @@ async def home() -> str:
         <div id="result">
             <div id="qrcode"></div>
             <div class="sats-amount" id="satsAmount"></div>
+            <div class="payment-status" id="paymentStatus"></div>
             <div class="invoice-box">
                 <div class="invoice-text" id="invoice"></div>
                 <button class="copy-btn" onclick="copyInvoice()">📋 Copy Invoice</button>
@@ -437,6 +623,7 @@ async def home() -> str:
                     selectedService = card.dataset.service;
                     document.getElementById('currencyLabel').textContent = card.dataset.currency;
                     updateMerchantInfo(card.dataset.service);
+                    updateQuote();
                 });
             });
             
@@ -464,6 +651,43 @@ async def home() -> str:
             }
         }
         
+        let quoteTimer = null;
+        let quoteSeq = 0;
+        let idempotencyKey = newIdempotencyKey();
+        
+        function newIdempotencyKey() {
+            return window.crypto && crypto.randomUUID
+                ? crypto.randomUUID()
+                : `${Date.now()}-${Math.random().toString(36).slice(2)}`;
+        }
+        
+        function updateQuote() {
+            idempotencyKey = newIdempotencyKey();
+            clearTimeout(quoteTimer);
+            const quoteEl = document.getElementById('quote');
+            const amount = parseFloat(document.getElementById('amount').value);
+            const seq = ++quoteSeq;
+            if (!selectedService || !(amount > 0)) {
+                quoteEl.textContent = '';
+                return;
+            }
+            quoteTimer = setTimeout(async () => {
+                try {
+                    const params = new URLSearchParams({ service: selectedService, amount });
+                    const response = await fetch(`/api/quote?${params}`);
+                    const quote = response.ok ? await response.json() : null;
+                    if (seq !== quoteSeq) return;
+                    quoteEl.textContent = quote
+                        ? `≈ ₿${quote.sats.toLocaleString()} ($${quote.usd_amount.toFixed(2)})`
+                        : '';
+                } catch (err) {
+                    quoteEl.textContent = '';
+                }
+            }, 250);
+        }
+        
+        document.getElementById('amount').addEventListener('input', updateQuote);
+        
         function showAllMerchants() {
             renderMerchants(true);
         }
@@ -498,9 +722,12 @@ async def home() -> str:
             error.style.display = 'none';
             
             try {
-                const response = await fetch('/create-invoice', {
+                const response = await fetch('/create-invoice/events', {
                     method: 'POST',
-                    headers: { 'Content-Type': 'application/json' },
+                    headers: {
+                        'Content-Type': 'application/json',
+                        'Idempotency-Key': idempotencyKey
+                    },
                     body: JSON.stringify({ amount, service: selectedService })
                 });
                 
@@ -509,23 +736,82 @@ async def home() -> str:
                     throw new Error(data.detail || 'Failed to create invoice');
                 }
                 
-                const data = await response.json();
-                
-                document.getElementById('qrcode').innerHTML = 
-                    `<img src="data:image/png;base64,${data.qr_code}" alt="QR Code" style="max-width: 280px;" />`;
-                document.getElementById('satsAmount').textContent = `₿${data.sats.toLocaleString()}`;
-                document.getElementById('invoice').textContent = data.invoice;
-                
-                result.style.display = 'block';
+                for await (const [event, data] of readEvents(response)) {
+                    if (event === 'usd') {
+                        loading.textContent = `⚡ Creating payment for $${data.usd_amount.toFixed(2)}...`;
+                    } else if (event === 'rozo') {
+                        loading.textContent = '⚡ Generating Lightning invoice...';
+                    } else if (event === 'invoice') {
+                        document.getElementById('qrcode').innerHTML = 
+                            '<div style="width: 280px; height: 280px; margin: 0 auto;"></div>';
+                        document.getElementById('satsAmount').textContent = `₿${data.sats.toLocaleString()}`;
+                        document.getElementById('invoice').textContent = data.invoice;
+                        watchStatus(data.id);
+                        idempotencyKey = newIdempotencyKey();
+                        loading.style.display = 'none';
+                        result.style.display = 'block';
+                    } else if (event === 'qr') {
+                        document.getElementById('qrcode').innerHTML = 
+                            `<img src="${data.qr_url}" alt="QR Code" style="width: 280px; image-rendering: pixelated;" />`;
+                    } else if (event === 'error') {
+                        throw new Error(data.detail || 'Failed to create invoice');
+                    }
+                }
             } catch (err) {
                 error.textContent = err.message;
                 error.style.display = 'block';
             } finally {
                 submitBtn.disabled = false;
                 loading.style.display = 'none';
+                loading.textContent = '⚡ Generating invoice...';
             }
         });
         
+        async function* readEvents(response) {
+            const reader = response.body.pipeThrough(new TextDecoderStream()).getReader();
+            let buffer = '';
+            while (true) {
+                const { value, done } = await reader.read();
+                if (done) return;
+                buffer += value;
+                let end;
+                while ((end = buffer.indexOf('\\n\\n')) !== -1) {
+                    const block = buffer.slice(0, end);
+                    buffer = buffer.slice(end + 2);
+                    let event = 'message';
+                    let data = '';
+                    for (const line of block.split('\\n')) {
+                        if (line.startsWith('event: ')) event = line.slice(7);
+                        else if (line.startsWith('data: ')) data += line.slice(6);
+                    }
+                    if (data) yield [event, JSON.parse(data)];
+                }
+            }
+        }
+        
+        const statusLabels = {
+            pending: '⏳ Waiting for payment...',
+            paid: '⚡ Paid! Settling with merchant...',
+            completed: '✅ Payment complete',
+            failed: '❌ Payment failed',
+            expired: '⌛ Invoice expired'
+        };
+        let statusSource = null;
+        
+        function watchStatus(invoiceId) {
+            if (statusSource) statusSource.close();
+            const statusEl = document.getElementById('paymentStatus');
+            statusEl.textContent = statusLabels.pending;
+            statusSource = new EventSource(`/api/invoices/${invoiceId}/events`);
+            statusSource.addEventListener('status', (e) => {
+                const status = JSON.parse(e.data);
+                statusEl.textContent = statusLabels[status.state];
+                if (['completed', 'failed', 'expired'].includes(status.state)) {
+                    statusSource.close();
+                }
+            });
+        }
+        
         async function copyInvoice() {
             const invoice = document.getElementById('invoice').textContent;
             await navigator.clipboard.writeText(invoice);
@@ -538,27 +824,240 @@ async def home() -> str:
 </body>
 </html>
 """
+home_page = StaticAsset(HOME_HTML.encode(), "text/html; charset=utf-8")
 
 
-@app.post("/create-invoice")
-async def create_invoice(req: PaymentRequest) -> dict[str, str | int]:
+@app.get("/", response_class=HTMLResponse)
+async def home(request: Request) -> Response:
+    return home_page.response(request)
+
+
+def invoice_response(invoice: InvoiceDict) -> dict[str, str | int]:
+    return {
+        "id": invoice["id"],
+        "invoice": invoice["invoice"],
+        "sats": invoice["sats"],
+        "expires_at": invoice["expires_at"],
+        "qr_url": f"/qr/{invoice['id']}.png",
+    }
+
+
+async def create_and_render(
+    service: str,
+    amount: float,
+    idempotency_key: str | None,
+    client: str,
+    rates: dict[str, float] | None = None,
+    on_progress: ProgressCallback | None = None,
+    budget: float = INVOICE_DEADLINE,
+) -> tuple[InvoiceDict, bool]:
+    merchant = merchant_label(service)
+    with (
+        tracer.trace("create_invoice", service=service, amount=amount) as span,
+        observe_stage("total", merchant),
+        deadline(budget),
+    ):
+        invoice, replayed = await issue_invoice_once(
+            service, amount, idempotency_key, client, rates, on_progress
+        )
+        span["invoice_id"] = invoice["id"]
+        span["replayed"] = replayed
+        if on_progress is not None:
+            on_progress(
+                "invoice",
+                {**invoice_response(invoice), "usd_amount": invoice["usd_amount"]},
+            )
+        with observe_stage("qr", merchant), tracer.span("qr", fmt="png") as qr_span:
+            try:
+                async with stage_deadline("qr"):
+                    await qr_image(invoice["id"], invoice["invoice"], "png")
+            except DeadlineExceededError:
+                qr_span["deferred"] = True
+        if on_progress is not None:
+            on_progress("qr", {"qr_url": f"/qr/{invoice['id']}.png"})
+    return invoice, replayed
+
+
+def admit(request: Request, cost: float = 1.0) -> str:
+    client = request.client.host if request.client else ""
+    wait = rate_limiter.acquire(client, cost)
+    if math.isinf(wait):
+        raise HTTPException(
+            status_code=422,
+            detail=f"Request cost {cost:g} exceeds the rate limit burst "
+            f"of {rate_limiter.burst:g}",
+        )
+    if wait > 0:
+        raise HTTPException(
+            status_code=429,
+            detail="Too many requests",
+            headers={"Retry-After": str(max(math.ceil(wait), 1))},
+        )
+    return client
+
+
+def request_budget(request: Request) -> float:
+    value = request.headers.get(DEADLINE_HEADER)
+    if value is None:
+        return INVOICE_DEADLINE
     try:
-        receiving_address, usdc_amount = await create_rozo_payment(
-            merchant_id=req.service, local_amount=req.amount
+        budget = float(value)
+    except ValueError:
+        budget = 0.0
+    if not budget > 0:
+        raise HTTPException(status_code=422, detail=f"Invalid {DEADLINE_HEADER} header")
+    return min(budget, INVOICE_DEADLINE_MAX)
+
+
+def http_error(e: Exception) -> HTTPException:
+    if isinstance(e, HTTPException):
+        return e
+    if isinstance(e, IdempotencyKeyReusedError):
+        return HTTPException(status_code=422, detail=str(e))
+    if isinstance(e, InvoiceMismatchError):
+        return HTTPException(status_code=502, detail=str(e))
+    if isinstance(e, DeadlineExceededError):
+        return HTTPException(status_code=504, detail=str(e))
+    if isinstance(e, UpstreamUnavailableError):
+        return HTTPException(
+            status_code=503,
+            detail=str(e),
+            headers={"Retry-After": str(max(math.ceil(e.retry_after), 1))},
         )
-        ln_invoice, _, sats_required = await create_ln_payment_for_rozo(
-            receiving_address=receiving_address, usd_amount=usdc_amount
+    return HTTPException(status_code=500, detail=str(e))
+
+
+@app.post("/create-invoice")
+async def create_invoice(
+    req: PaymentRequest, request: Request, response: Response
+) -> dict[str, str | int]:
+    client = admit(request)
+    budget = request_budget(request)
+    try:
+        invoice, replayed = await create_and_render(
+            req.service,
+            req.amount,
+            request.headers.get("idempotency-key"),
+            client,
+            budget=budget,
         )
+        if replayed:
+            response.headers["Idempotent-Replayed"] = "true"
+        return invoice_response(invoice)
+    except Exception as e:
+        raise http_error(e)
+
 
-        qr = qrcode.QRCode(version=1, box_size=10, border=2)
-        qr.add_data(ln_invoice)
-        qr.make(fit=True)
+@app.post("/create-invoice/events")
+async def create_invoice_events(
+    req: PaymentRequest, request: Request
+) -> StreamingResponse:
+    client = admit(request)
+    budget = request_budget(request)
+    events: asyncio.Queue[str | None] = asyncio.Queue()
 
-        img = qr.make_image(fill_color="black", back_color="white")
-        buf = io.BytesIO()
-        img.save(buf, format="PNG")
-        qr_base64 = base64.b64encode(buf.getvalue()).decode()
+    def progress(stage: str, data: dict[str, str | int | float]) -> None:
+        events.put_nowait(sse_event(stage, data))
 
-        return {"invoice": ln_invoice, "qr_code": qr_base64, "sats": sats_required}
+    async def create() -> None:
+        try:
+            await create_and_render(
+                req.service,
+                req.amount,
+                request.headers.get("idempotency-key"),
+                client,
+                on_progress=progress,
+                budget=budget,
+            )
+        except Exception as e:
+            error = http_error(e)
+            progress("error", {"status": error.status_code, "detail": error.detail})
+        finally:
+            events.put_nowait(None)
+
+    async def stream() -> AsyncIterator[str]:
+        task = asyncio.create_task(create())
+        try:
+            while (event := await events.get()) is not None:
+                yield event
+        finally:
+            task.cancel()
+
+    return StreamingResponse(
+        stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@app.post("/create-invoices")
+async def create_invoices(
+    reqs: list[PaymentRequest], request: Request
+) -> StreamingResponse:
+    max_items = BATCH_MAX_ITEMS
+    if rate_limiter.enabled:
+        max_items = min(max_items, int(rate_limiter.burst))
+    if len(reqs) > max_items:
+        raise HTTPException(
+            status_code=422, detail=f"At most {max_items} items per batch"
+        )
+    client = admit(request, len(reqs))
+    budget = request_budget(request)
+    try:
+        rates = await fx_rates.get("USD")
     except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+        raise HTTPException(status_code=503, detail=str(e))
+    batch_key = request.headers.get("idempotency-key") or uuid.uuid4().hex
+    semaphore = asyncio.Semaphore(BATCH_CONCURRENCY)
+
+    async def create(index: int, req: PaymentRequest) -> dict[str, str | int | bool]:
+        async with semaphore:
+            try:
+                invoice, _ = await create_and_render(
+                    req.service,
+                    req.amount,
+                    f"{batch_key}:{index}",
+                    client,
+                    rates,
+                    budget=budget,
+                )
+            except Exception as e:
+                error = http_error(e)
+                return {
+                    "index": index,
+                    "ok": False,
+                    "status": error.status_code,
+                    "detail": error.detail,
+                }
+            return {"index": index, "ok": True, **invoice_response(invoice)}
+
+    async def stream() -> AsyncIterator[str]:
+        tasks = [asyncio.create_task(create(i, req)) for i, req in enumerate(reqs)]
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                yield json.dumps(await next_done) + "\n"
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    return StreamingResponse(stream(), media_type="application/x-ndjson")
+
+
+@app.get("/qr/{invoice_id}.{fmt}")
+async def get_qr(
+    invoice_id: str, fmt: Literal["png", "svg"], request: Request
+) -> Response:
+    invoice = await find_invoice(invoice_id)
+    if invoice is None:
+        raise HTTPException(status_code=404, detail="Unknown invoice")
+    remaining = int(invoice["expires_at"] - time.time())
+    if remaining <= 0:
+        raise HTTPException(status_code=410, detail="Invoice expired")
+    headers = {
+        "ETag": f'"{invoice_id}.{fmt}"',
+        "Cache-Control": f"public, max-age={min(remaining, 86400)}, immutable",
+    }
+    if etag_matches(request, headers["ETag"]):
+        return Response(status_code=304, headers=headers)
+    image = await qr_image(invoice_id, invoice["invoice"], fmt)
+    return Response(image, media_type=MEDIA_TYPES[fmt], headers=headers)
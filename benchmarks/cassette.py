@@ -0,0 +1,219 @@
+import argparse
+import asyncio
+import gzip
+import json
+import random
+import re
+import time
+import uuid
+from collections import defaultdict
+from typing import Any, TypedDict
+
+import httpx
+
+import http_client
+from benchmarks.fake_upstreams import fake_bolt11
+from bolt11 import decode as decode_bolt11
+from invoices import issue_invoice
+from rozo import load_service_config
+
+CASSETTE_VERSION = 1
+ID_SEGMENT = re.compile(r"[0-9a-fA-F-]{16,}|[0-9A-Za-z_-]*\d[0-9A-Za-z_-]{15,}")
+
+
+class InteractionDict(TypedDict):
+    key: str
+    method: str
+    url: str
+    request: Any
+    status: int
+    content_type: str
+    body: Any
+    elapsed: float
+
+
+def route_key(request: httpx.Request) -> str:
+    path = "/".join(
+        "{id}" if ID_SEGMENT.fullmatch(segment) else segment
+        for segment in request.url.path.split("/")
+    )
+    return f"{request.method} {request.url.host}{path}"
+
+
+def _json_or_text(content: bytes) -> Any:
+    try:
+        return json.loads(content)
+    except ValueError:
+        return content.decode("utf-8", "replace")
+
+
+def load_cassette(path: str) -> list[InteractionDict]:
+    with gzip.open(path, "rt") as f:
+        header = json.loads(f.readline())
+        if header.get("version") != CASSETTE_VERSION:
+            raise ValueError(f"Unsupported cassette version in {path}")
+        return [json.loads(line) for line in f]
+
+
+def save_cassette(path: str, interactions: list[InteractionDict]) -> None:
+    with gzip.open(path, "wt") as f:
+        f.write(json.dumps({"version": CASSETTE_VERSION, "recorded_at": time.time()}))
+        f.write("\n")
+        for interaction in interactions:
+            f.write(json.dumps(interaction, separators=(",", ":")))
+            f.write("\n")
+
+
+class RecordingTransport(httpx.AsyncBaseTransport):
+    def __init__(self, inner: httpx.AsyncBaseTransport) -> None:
+        self.inner = inner
+        self.interactions: list[InteractionDict] = []
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        start = time.perf_counter()
+        response = await self.inner.handle_async_request(request)
+        content = await response.aread()
+        self.interactions.append(
+            {
+                "key": route_key(request),
+                "method": request.method,
+                "url": str(request.url.copy_with(query=None)),
+                "request": _json_or_text(request.content) if request.content else None,
+                "status": response.status_code,
+                "content_type": response.headers.get("content-type", ""),
+                "body": _json_or_text(content),
+                "elapsed": round(time.perf_counter() - start, 4),
+            }
+        )
+        return httpx.Response(
+            response.status_code,
+            headers=response.headers,
+            content=content,
+            extensions=response.extensions,
+        )
+
+    async def aclose(self) -> None:
+        await self.inner.aclose()
+
+
+def _paired_leaves(recorded: Any, live: Any, out: dict[str, str]) -> dict[str, str]:
+    if isinstance(recorded, dict) and isinstance(live, dict):
+        for key, item in recorded.items():
+            if key in live:
+                _paired_leaves(item, live[key], out)
+    elif isinstance(recorded, list) and isinstance(live, list):
+        for a, b in zip(recorded, live):
+            _paired_leaves(a, b, out)
+    elif isinstance(recorded, str) and isinstance(live, str) and len(recorded) >= 8:
+        out[recorded] = live
+    return out
+
+
+def _substitute(value: Any, mapping: dict[str, str]) -> Any:
+    if isinstance(value, dict):
+        return {key: _substitute(item, mapping) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_substitute(item, mapping) for item in value]
+    if isinstance(value, str):
+        return mapping.get(value, value)
+    return value
+
+
+class ReplayTransport(httpx.AsyncBaseTransport):
+    def __init__(
+        self,
+        interactions: list[InteractionDict],
+        latency_scale: float = 1.0,
+        seed: int = 0,
+    ) -> None:
+        self.latency_scale = latency_scale
+        self._random = random.Random(seed)
+        self._by_key: dict[str, list[InteractionDict]] = defaultdict(list)
+        self._next: dict[str, int] = defaultdict(int)
+        for interaction in interactions:
+            self._by_key[interaction["key"]].append(interaction)
+
+    def _fresh_id(self) -> str:
+        return str(uuid.UUID(int=self._random.getrandbits(128), version=4))
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        key = route_key(request)
+        recorded = self._by_key.get(key)
+        if not recorded:
+            raise httpx.ConnectError(f"No cassette entry for {key}", request=request)
+        index = self._next[key]
+        self._next[key] = index + 1
+        interaction = recorded[index % len(recorded)]
+        await asyncio.sleep(interaction["elapsed"] * self.latency_scale)
+
+        mapping = _paired_leaves(
+            httpx.URL(interaction["url"]).path.split("/"),
+            request.url.path.split("/"),
+            {},
+        )
+        if interaction["request"] is not None and request.content:
+            _paired_leaves(interaction["request"], json.loads(request.content), mapping)
+        body = interaction["body"]
+        if request.method == "POST" and isinstance(body, dict) and "id" in body:
+            mapping[body["id"]] = self._fresh_id()
+        body = _substitute(body, mapping)
+        if isinstance(body, dict) and "ln_invoice" in body and "hash_lock" in body:
+            recorded_invoice = decode_bolt11(body["ln_invoice"])
+            body["ln_invoice"] = fake_bolt11(
+                (recorded_invoice["amount_msat"] or 0) // 1000,
+                body["hash_lock"].removeprefix("0x"),
+                recorded_invoice["expiry"],
+            )
+        headers = {"content-type": interaction["content_type"]}
+        if isinstance(body, str):
+            return httpx.Response(interaction["status"], headers=headers, text=body)
+        return httpx.Response(
+            interaction["status"],
+            headers=headers,
+            content=json.dumps(body).encode(),
+        )
+
+
+async def record(args: argparse.Namespace) -> None:
+    recorder = RecordingTransport(http_client.default_transport())
+    http_client.create_client(recorder)
+    try:
+        await load_service_config()
+        for _ in range(args.invoices):
+            invoice = await issue_invoice(args.service, args.amount)
+            print(f"recorded invoice {invoice['id']} ({invoice['sats']} sats)")
+    finally:
+        await http_client.close_client()
+    save_cassette(args.out, recorder.interactions)
+    print(f"wrote {len(recorder.interactions)} interactions to {args.out}")
+
+
+def show(args: argparse.Namespace) -> None:
+    by_key: dict[str, list[float]] = defaultdict(list)
+    for interaction in load_cassette(args.path):
+        by_key[interaction["key"]].append(interaction["elapsed"])
+    for key, elapsed in sorted(by_key.items()):
+        print(f"{len(elapsed):4}x {sum(elapsed) / len(elapsed) * 1000:8.1f} ms  {key}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Record upstream traffic to a cassette or inspect one"
+    )
+    commands = parser.add_subparsers(dest="command", required=True)
+    record_parser = commands.add_parser("record", help="Issue real invoices")
+    record_parser.add_argument("--out", default="cassette.jsonl.gz")
+    record_parser.add_argument("--service", default="cafe")
+    record_parser.add_argument("--amount", type=float, default=5.0)
+    record_parser.add_argument("--invoices", type=int, default=3)
+    show_parser = commands.add_parser("show", help="Summarize a cassette")
+    show_parser.add_argument("path")
+    args = parser.parse_args()
+    if args.command == "record":
+        asyncio.run(record(args))
+    else:
+        show(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,137 @@
+import asyncio
+import json
+import random
+import secrets
+import time
+import uuid
+from typing import TypedDict
+
+import httpx
+
+from bolt11 import CHARSET, bech32_checksum, convertbits
+
+
+class LatencyProfile(TypedDict):
+    latency: float
+    jitter: float
+    error_rate: float
+
+
+PROFILES: dict[str, dict[str, LatencyProfile]] = {
+    "instant": {
+        "merchants": {"latency": 0.0, "jitter": 0.0, "error_rate": 0.0},
+        "fx": {"latency": 0.0, "jitter": 0.0, "error_rate": 0.0},
+        "rozo": {"latency": 0.0, "jitter": 0.0, "error_rate": 0.0},
+        "lendasat": {"latency": 0.0, "jitter": 0.0, "error_rate": 0.0},
+    },
+    "realistic": {
+        "merchants": {"latency": 0.15, "jitter": 0.05, "error_rate": 0.0},
+        "fx": {"latency": 0.12, "jitter": 0.04, "error_rate": 0.0},
+        "rozo": {"latency": 0.45, "jitter": 0.15, "error_rate": 0.0},
+        "lendasat": {"latency": 0.6, "jitter": 0.2, "error_rate": 0.0},
+    },
+    "flaky": {
+        "merchants": {"latency": 0.15, "jitter": 0.1, "error_rate": 0.05},
+        "fx": {"latency": 0.12, "jitter": 0.1, "error_rate": 0.1},
+        "rozo": {"latency": 0.45, "jitter": 0.4, "error_rate": 0.05},
+        "lendasat": {"latency": 0.6, "jitter": 0.5, "error_rate": 0.05},
+    },
+}
+
+MERCHANTS = [
+    {"id": "cafe", "name": "NS Cafe", "currency": "MYR"},
+    {"id": "laundry", "name": "Laundry", "currency": "MYR"},
+    {"id": "ride", "name": "Ride", "currency": "MYR"},
+    {"id": "spa", "name": "Spa", "currency": "USD"},
+]
+USD_PER_SAT = 0.001
+INVOICE_EXPIRY = 3600
+
+
+def int_groups(value: int, length: int) -> list[int]:
+    return [(value >> 5 * i) & 31 for i in reversed(range(length))]
+
+
+def fake_bolt11(sats: int, payment_hash: str, expiry: int = INVOICE_EXPIRY) -> str:
+    hrp = f"lnbc{sats * 10}n"
+    data = int_groups(int(time.time()), 7)
+    for tag, value in (
+        (1, convertbits(bytes.fromhex(payment_hash), 8, 5)),
+        (6, int_groups(expiry, 3)),
+    ):
+        data += [tag, len(value) >> 5, len(value) & 31, *value]
+    data += convertbits(secrets.token_bytes(65), 8, 5)
+    return hrp + "1" + "".join(CHARSET[d] for d in data + bech32_checksum(hrp, data))
+
+
+def upstream_for(host: str) -> str:
+    if "supabase" in host:
+        return "merchants"
+    if "exchangerate" in host:
+        return "fx"
+    if "rozo" in host:
+        return "rozo"
+    if "lendasat" in host:
+        return "lendasat"
+    raise ValueError(f"No fake upstream for {host}")
+
+
+def respond(upstream: str, request: httpx.Request) -> httpx.Response:
+    if upstream == "merchants":
+        return httpx.Response(200, json=MERCHANTS)
+    if upstream == "fx":
+        return httpx.Response(200, json={"base": "USD", "rates": {"MYR": 4.2}})
+    if request.method == "GET":
+        status = "payment_unpaid" if upstream == "rozo" else "pending"
+        swap_id = request.url.path.rsplit("/", 1)[-1]
+        return httpx.Response(200, json={"id": swap_id, "status": status})
+    body = json.loads(request.content)
+    if upstream == "rozo":
+        amount = body["destination"]["amountUnits"]
+        address = "0x" + secrets.token_hex(20)
+        return httpx.Response(
+            200,
+            json={
+                "id": str(uuid.uuid4()),
+                "status": "payment_unpaid",
+                "createdAt": "",
+                "display": body["display"],
+                "source": None,
+                "destination": {**body["destination"], "txHash": None},
+                "metadata": {**body["metadata"], "receivingAddress": address},
+                "url": "",
+                "amountUnits": amount,
+            },
+        )
+    sats = round(body["usd_amount"] / USD_PER_SAT)
+    fee = max(sats // 100, 1)
+    return httpx.Response(
+        200,
+        json={
+            "id": str(uuid.uuid4()),
+            "status": "pending",
+            "polygon_address": body["polygon_address"],
+            "arkade_address": "",
+            "ln_invoice": fake_bolt11(sats + fee, body["hash_lock"].removeprefix("0x")),
+            "sats_required": sats + fee,
+            "fee_sats": fee,
+            "usd_amount": body["usd_amount"],
+            "usd_per_sat": USD_PER_SAT,
+            "hash_lock": body["hash_lock"],
+        },
+    )
+
+
+def fake_transport(
+    profile: dict[str, LatencyProfile], latency_scale: float = 1.0
+) -> httpx.MockTransport:
+    async def handler(request: httpx.Request) -> httpx.Response:
+        upstream = upstream_for(request.url.host)
+        settings = profile[upstream]
+        delay = random.gauss(settings["latency"], settings["jitter"]) * latency_scale
+        await asyncio.sleep(max(delay, 0.0))
+        if random.random() < settings["error_rate"]:
+            return httpx.Response(503, json={"error": "injected failure"})
+        return respond(upstream, request)
+
+    return httpx.MockTransport(handler)
@@ -0,0 +1,114 @@
+import argparse
+import asyncio
+import random
+import tempfile
+import time
+import uuid
+
+import httpx
+
+import app
+import http_client
+from benchmarks.cassette import ReplayTransport, load_cassette
+from benchmarks.fake_upstreams import PROFILES, fake_transport
+from benchmarks.qr_loop_stall import monitor_loop
+from journal import swap_journal
+from rozo import merchant_snapshot_file
+from shared_cache import shared_store
+
+
+def percentile(values: list[float], q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(int(len(ordered) * q), len(ordered) - 1)]
+
+
+async def run(args: argparse.Namespace) -> None:
+    profile = PROFILES[args.profile]
+    for upstream in profile.values():
+        if args.error_rate is not None:
+            upstream["error_rate"] = args.error_rate
+    if args.cassette:
+        transport: httpx.AsyncBaseTransport = ReplayTransport(
+            load_cassette(args.cassette), args.latency_scale
+        )
+    else:
+        transport = fake_transport(profile, args.latency_scale)
+    app.create_client = lambda: http_client.create_client(transport)
+
+    latencies: list[float] = []
+    statuses: dict[int, int] = {}
+    remaining = iter(range(args.requests))
+
+    async def client(c: httpx.AsyncClient) -> None:
+        for _ in remaining:
+            payload = {
+                "service": random.choice(["cafe", "laundry", "ride", "spa"]),
+                "amount": round(random.uniform(5, 80), 2),
+            }
+            start = time.perf_counter()
+            response = await c.post(
+                "/create-invoice",
+                json=payload,
+                headers={"Idempotency-Key": str(uuid.uuid4())},
+            )
+            latencies.append(time.perf_counter() - start)
+            statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+
+    with tempfile.TemporaryDirectory() as tmp:
+        swap_journal.path = f"{tmp}/swaps.db"
+        shared_store.path = f"{tmp}/cache.db"
+        merchant_snapshot_file.path = f"{tmp}/merchants.json"
+        async with app.lifespan(app.app):
+            asgi = httpx.ASGITransport(app=app.app)
+            async with httpx.AsyncClient(
+                transport=asgi, base_url="http://bench", timeout=None
+            ) as c:
+                for _ in range(args.warmup):
+                    await c.post(
+                        "/create-invoice", json={"service": "cafe", "amount": 10}
+                    )
+                stop = asyncio.Event()
+                lags: list[float] = []
+                monitor = asyncio.create_task(monitor_loop(stop, lags))
+                start = time.perf_counter()
+                await asyncio.gather(*(client(c) for _ in range(args.clients)))
+                elapsed = time.perf_counter() - start
+                stop.set()
+                await monitor
+
+    source = f"cassette={args.cassette}" if args.cassette else f"profile={args.profile}"
+    print(
+        f"{source} clients={args.clients} requests={args.requests} "
+        f"latency_scale={args.latency_scale}"
+    )
+    print(f"throughput  {args.requests / elapsed:10.1f} req/s")
+    for q in (0.5, 0.95, 0.99):
+        print(f"p{int(q * 100):<10} {percentile(latencies, q) * 1000:10.1f} ms")
+    print(f"max         {max(latencies, default=0) * 1000:10.1f} ms")
+    print(
+        f"loop lag    p99={percentile(lags, 0.99) * 1000:.2f} ms "
+        f"max={max(lags, default=0) * 1000:.2f} ms"
+    )
+    print(f"statuses    {dict(sorted(statuses.items()))}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Load-test /create-invoice against fake upstreams"
+    )
+    parser.add_argument("--profile", choices=PROFILES, default="realistic")
+    parser.add_argument("--clients", type=int, default=20)
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--warmup", type=int, default=3)
+    parser.add_argument("--latency-scale", type=float, default=1.0)
+    parser.add_argument("--error-rate", type=float, default=None)
+    parser.add_argument(
+        "--cassette", help="Replay upstreams from a recorded cassette instead"
+    )
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
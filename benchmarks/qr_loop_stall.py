@@ -0,0 +1,67 @@
+import argparse
+import asyncio
+import secrets
+import time
+
+from qr import QrRenderer
+
+TICK = 0.001
+
+
+def sample_invoice() -> str:
+    return "lnbc" + secrets.token_hex(180)
+
+
+async def monitor_loop(stop: asyncio.Event, lags: list[float]) -> None:
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(TICK)
+        lags.append(max(time.perf_counter() - start - TICK, 0.0))
+
+
+async def run(kind: str, size: int, requests: int, concurrency: int) -> None:
+    renderer = QrRenderer(kind=kind, size=size)
+    renderer.start()
+    await renderer.render(sample_invoice())
+
+    invoices = [sample_invoice() for _ in range(requests)]
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def render(invoice: str) -> None:
+        async with semaphore:
+            await renderer.render(invoice)
+
+    stop = asyncio.Event()
+    lags: list[float] = []
+    monitor = asyncio.create_task(monitor_loop(stop, lags))
+    start = time.perf_counter()
+    await asyncio.gather(*(render(invoice) for invoice in invoices))
+    elapsed = time.perf_counter() - start
+    stop.set()
+    await monitor
+    renderer.shutdown()
+
+    lags.sort()
+    p99 = lags[int(len(lags) * 0.99) - 1] if lags else 0.0
+    print(
+        f"{kind:>8} size={size:<2} {requests / elapsed:8.1f} renders/s  "
+        f"stall max={max(lags, default=0) * 1000:7.2f}ms  "
+        f"p99={p99 * 1000:7.2f}ms  total={sum(lags) * 1000:8.1f}ms"
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Measure event-loop stall while rendering QR codes concurrently"
+    )
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--size", type=int, default=2)
+    parser.add_argument("--kinds", nargs="+", default=["inline", "thread", "process"])
+    args = parser.parse_args()
+    for kind in args.kinds:
+        asyncio.run(run(kind, args.size, args.requests, args.concurrency))
+
+
+if __name__ == "__main__":
+    main()
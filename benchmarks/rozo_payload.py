@@ -0,0 +1,117 @@
+import argparse
+import json
+import time
+import timeit
+
+from benchmarks.fake_upstreams import MERCHANTS
+from rozo import (
+    ServiceConfigDict,
+    build_service_config,
+    generate_order_id,
+    payment_request_payload,
+    payment_values,
+)
+
+
+def legacy_payment_request(
+    config: ServiceConfigDict, local_amount: float, usd_amount: float
+) -> bytes:
+    timestamp = int(time.time() * 1000)
+    order_id = f"{config['order_prefix']}-{timestamp}"
+    daimo_order_id = generate_order_id()
+
+    intent = config["intent_template"].format(usd_amount=f"{usd_amount:.2f}")
+    item_desc = config["item_desc_template"].format(
+        local_amount=int(local_amount) if local_amount.is_integer() else local_amount,
+        usd_amount=f"{usd_amount:.2f}",
+    )
+
+    payload = {
+        "appId": config["app_id"],
+        "display": {
+            "intent": intent,
+            "paymentValue": str(usd_amount),
+            "currency": "USD",
+        },
+        "destination": {
+            "destinationAddress": "0x5772FBe7a7817ef7F586215CA8b23b8dD22C8897",
+            "chainId": "8453",
+            "amountUnits": str(usd_amount),
+            "tokenSymbol": "USDC",
+            "tokenAddress": "0x833589fCD6eDb6E08f4c7C32D4f71b54bdA02913",
+        },
+        "externalId": "",
+        "metadata": {
+            "daimoOrderId": daimo_order_id,
+            "preferredChain": "137",
+            "preferredToken": "USDC",
+            "preferredTokenAddress": "0x3c499c542cEF5E3811e1192ce70d8cC03d5c3359",
+            "intent": intent,
+            "items": [
+                {"name": config["item_name"], "description": item_desc},
+                {"name": "Order ID", "description": order_id},
+            ],
+            "payer": {},
+            "appId": config["app_id"],
+            "amount_local": str(
+                int(local_amount) if local_amount.is_integer() else local_amount
+            ),
+            "currency_local": config["currency_local"],
+            "merchant_order_id": order_id,
+            "receiptUrl": f"https://ns.rozo.ai/payment/success?order_id={order_id}",
+            "customDeeplinkUrl": config["deeplink"].format(
+                local_amount=int(local_amount)
+                if local_amount.is_integer()
+                else local_amount
+            ),
+        },
+        "preferredChain": "137",
+        "preferredToken": "USDC",
+        "preferredTokenAddress": "0x3c499c542cEF5E3811e1192ce70d8cC03d5c3359",
+    }
+    return json.dumps(payload).encode()
+
+
+def templated_payment_request(
+    config: ServiceConfigDict, local_amount: float, usd_amount: float
+) -> bytes:
+    return config["payment_template"].render(
+        payment_values(config, local_amount, usd_amount)
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Compare per-request CPU cost of building Rozo payloads"
+    )
+    parser.add_argument("--iterations", type=int, default=50000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    config = build_service_config(MERCHANTS[0])
+    for local_amount in (50.0, 12.5):
+        values = payment_values(config, local_amount, 11.9)
+        rendered = json.loads(config["payment_template"].render(values))
+        assert rendered == payment_request_payload(config, values)
+        legacy = json.loads(legacy_payment_request(config, local_amount, 11.9))
+        for payload in (legacy, rendered):
+            payload["metadata"]["daimoOrderId"] = ""
+        assert legacy["display"] == rendered["display"]
+        assert legacy["metadata"]["amount_local"] == values["amount_local"]
+
+    for name, build in (
+        ("legacy", legacy_payment_request),
+        ("template", templated_payment_request),
+    ):
+        best = min(
+            timeit.repeat(
+                lambda: build(config, 50.0, 11.9),
+                number=args.iterations,
+                repeat=args.repeat,
+            )
+        )
+        print(f"{name:<10} {best / args.iterations * 1e6:8.2f} us/request")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,174 @@
+import re
+from collections.abc import Iterable
+from typing import TypedDict
+
+CHARSET = "qpzry9x8gf2tvdw0s3jn54khce6mua7l"
+CHARSET_INDEX = {c: i for i, c in enumerate(CHARSET)}
+GENERATOR = (0x3B6A57B2, 0x26508E6D, 0x1EA119FA, 0x3D4233DD, 0x2A1462B3)
+NETWORKS = {"bc": "bitcoin", "tb": "testnet", "tbs": "signet", "bcrt": "regtest"}
+HRP_PATTERN = re.compile(r"ln(bcrt|bc|tbs|tb)(?:(\d+)([munp]?))?")
+MSAT_PER_UNIT = {"": 100_000_000_000, "m": 100_000_000, "u": 100_000, "n": 100}
+DEFAULT_EXPIRY = 3600
+DEFAULT_MIN_FINAL_CLTV_EXPIRY = 18
+SIGNATURE_LENGTH = 104
+TIMESTAMP_LENGTH = 7
+
+TAG_PAYMENT_HASH = 1
+TAG_EXPIRY = 6
+TAG_DESCRIPTION = 13
+TAG_PAYEE = 19
+TAG_DESCRIPTION_HASH = 23
+TAG_MIN_FINAL_CLTV_EXPIRY = 24
+
+
+class Bolt11Error(ValueError):
+    pass
+
+
+class Bolt11Dict(TypedDict):
+    network: str
+    amount_msat: int | None
+    timestamp: int
+    expiry: int
+    expires_at: int
+    payment_hash: str
+    description: str | None
+    description_hash: str | None
+    payee: str | None
+    min_final_cltv_expiry: int
+
+
+def _generator_mask(top: int) -> int:
+    mask = 0
+    for i, generator in enumerate(GENERATOR):
+        if (top >> i) & 1:
+            mask ^= generator
+    return mask
+
+
+GENERATOR_MASKS = [_generator_mask(top) for top in range(32)]
+
+
+def bech32_polymod(values: Iterable[int]) -> int:
+    chk = 1
+    masks = GENERATOR_MASKS
+    for value in values:
+        chk = (chk & 0x1FFFFFF) << 5 ^ value ^ masks[chk >> 25]
+    return chk
+
+
+def bech32_hrp_expand(hrp: str) -> list[int]:
+    return [ord(c) >> 5 for c in hrp] + [0] + [ord(c) & 31 for c in hrp]
+
+
+def bech32_checksum(hrp: str, data: list[int]) -> list[int]:
+    polymod = bech32_polymod(bech32_hrp_expand(hrp) + data + [0] * 6) ^ 1
+    return [(polymod >> 5 * (5 - i)) & 31 for i in range(6)]
+
+
+def convertbits(
+    data: Iterable[int], frombits: int, tobits: int, pad: bool = True
+) -> list[int]:
+    acc = 0
+    bits = 0
+    out = []
+    maxv = (1 << tobits) - 1
+    for value in data:
+        acc = (acc << frombits) | value
+        bits += frombits
+        while bits >= tobits:
+            bits -= tobits
+            out.append((acc >> bits) & maxv)
+    if pad and bits:
+        out.append((acc << (tobits - bits)) & maxv)
+    return out
+
+
+def bech32_decode(bech: str) -> tuple[str, list[int]]:
+    if bech.lower() != bech and bech.upper() != bech:
+        raise Bolt11Error("Mixed-case invoice")
+    bech = bech.lower()
+    pos = bech.rfind("1")
+    if pos < 1 or pos + 7 > len(bech):
+        raise Bolt11Error("Missing bech32 separator")
+    hrp = bech[:pos]
+    try:
+        data = [CHARSET_INDEX[c] for c in bech[pos + 1 :]]
+    except KeyError as e:
+        raise Bolt11Error(f"Invalid bech32 character {e.args[0]!r}") from None
+    if bech32_polymod(bech32_hrp_expand(hrp) + data) != 1:
+        raise Bolt11Error("Invalid bech32 checksum")
+    return hrp, data[:-6]
+
+
+def _int(groups: list[int]) -> int:
+    value = 0
+    for group in groups:
+        value = value << 5 | group
+    return value
+
+
+def _bytes(groups: list[int]) -> bytes:
+    return bytes(convertbits(groups, 5, 8, pad=False))
+
+
+def parse_amount(amount: str | None, multiplier: str) -> int | None:
+    if amount is None:
+        return None
+    if multiplier == "p":
+        if int(amount) % 10:
+            raise Bolt11Error("Sub-millisatoshi amount")
+        return int(amount) // 10
+    return int(amount) * MSAT_PER_UNIT[multiplier]
+
+
+def decode(invoice: str) -> Bolt11Dict:
+    hrp, data = bech32_decode(invoice.strip().removeprefix("lightning:"))
+    match = HRP_PATTERN.fullmatch(hrp)
+    if match is None:
+        raise Bolt11Error(f"Not a lightning invoice prefix: {hrp!r}")
+    if len(data) < TIMESTAMP_LENGTH + SIGNATURE_LENGTH:
+        raise Bolt11Error("Invoice too short")
+    currency, amount, multiplier = match.groups()
+    timestamp = _int(data[:TIMESTAMP_LENGTH])
+    fields = data[TIMESTAMP_LENGTH:-SIGNATURE_LENGTH]
+    payment_hash = None
+    expiry = DEFAULT_EXPIRY
+    description = None
+    description_hash = None
+    payee = None
+    min_final_cltv_expiry = DEFAULT_MIN_FINAL_CLTV_EXPIRY
+    pos = 0
+    while pos + 3 <= len(fields):
+        tag = fields[pos]
+        length = fields[pos + 1] << 5 | fields[pos + 2]
+        value = fields[pos + 3 : pos + 3 + length]
+        if len(value) < length:
+            raise Bolt11Error("Truncated tagged field")
+        pos += 3 + length
+        if tag == TAG_PAYMENT_HASH and length == 52:
+            payment_hash = _bytes(value).hex()
+        elif tag == TAG_EXPIRY:
+            expiry = _int(value)
+        elif tag == TAG_DESCRIPTION:
+            description = _bytes(value).decode("utf-8", "replace")
+        elif tag == TAG_DESCRIPTION_HASH and length == 52:
+            description_hash = _bytes(value).hex()
+        elif tag == TAG_PAYEE and length == 53:
+            payee = _bytes(value).hex()
+        elif tag == TAG_MIN_FINAL_CLTV_EXPIRY:
+            min_final_cltv_expiry = _int(value)
+    if payment_hash is None:
+        raise Bolt11Error("Invoice has no payment hash")
+    return {
+        "network": NETWORKS[currency],
+        "amount_msat": parse_amount(amount, multiplier),
+        "timestamp": timestamp,
+        "expiry": expiry,
+        "expires_at": timestamp + expiry,
+        "payment_hash": payment_hash,
+        "description": description,
+        "description_hash": description_hash,
+        "payee": payee,
+        "min_final_cltv_expiry": min_final_cltv_expiry,
+    }
@@ -0,0 +1,283 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from collections.abc import Awaitable, Callable, Hashable, Iterable
+from typing import Generic, TypedDict, TypeVar
+
+from deadline import without_deadline
+from shared_cache import SharedTier
+
+logger = logging.getLogger(__name__)
+
+K = TypeVar("K", bound=Hashable)
+V = TypeVar("V")
+
+
+class CacheStatsDict(TypedDict):
+    hits: int
+    misses: int
+    stale_served: int
+    refreshes: int
+    refresh_errors: int
+    shared_hits: int
+    ages: dict[str, float]
+
+
+class RefreshingCache(Generic[K, V]):
+    def __init__(
+        self,
+        loader: Callable[[K], Awaitable[V]],
+        ttl: float,
+        refresh_interval: float | None = None,
+        max_stale: float | None = None,
+        stale_while_revalidate: bool = False,
+        shared: SharedTier[V] | None = None,
+    ) -> None:
+        self._loader = loader
+        self.ttl = ttl
+        self.refresh_interval = refresh_interval or ttl * 0.8
+        self.max_stale = max_stale
+        self.stale_while_revalidate = stale_while_revalidate
+        self.shared = shared
+        self._entries: dict[K, tuple[V, float]] = {}
+        self._inflight: dict[K, asyncio.Task[V]] = {}
+        self._refresher: asyncio.Task[None] | None = None
+        self._hits = 0
+        self._misses = 0
+        self._stale_served = 0
+        self._refreshes = 0
+        self._refresh_errors = 0
+        self._shared_hits = 0
+
+    def age(self, key: K) -> float | None:
+        entry = self._entries.get(key)
+        return time.monotonic() - entry[1] if entry is not None else None
+
+    def peek(self, key: K) -> V | None:
+        entry = self._entries.get(key)
+        return entry[0] if entry is not None else None
+
+    def _servable(self, age: float) -> bool:
+        return self.max_stale is None or age < self.max_stale
+
+    async def get(self, key: K) -> V:
+        entry = self._entries.get(key)
+        if entry is not None:
+            age = time.monotonic() - entry[1]
+            if age < self.ttl:
+                self._hits += 1
+                return entry[0]
+            if self.stale_while_revalidate and self._servable(age):
+                self._stale_served += 1
+                self._revalidate(key)
+                return entry[0]
+        self._misses += 1
+        try:
+            return await self.refresh(key)
+        except Exception:
+            if entry is None or not self._servable(time.monotonic() - entry[1]):
+                raise
+            logger.warning("Serving stale cache entry for %r", key, exc_info=True)
+            self._stale_served += 1
+            return entry[0]
+
+    async def refresh(self, key: K) -> V:
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.create_task(self._load(key), context=without_deadline())
+            self._inflight[key] = task
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        return await asyncio.shield(task)
+
+    async def _load(self, key: K) -> V:
+        self._refreshes += 1
+        try:
+            if self.shared is None:
+                value, age = await self._loader(key), 0.0
+            else:
+                value, age = await self.shared.load(
+                    str(key), self.refresh_interval, lambda: self._loader(key)
+                )
+        except Exception:
+            self._refresh_errors += 1
+            raise
+        if age > 0:
+            self._shared_hits += 1
+        self._entries[key] = (value, time.monotonic() - age)
+        return value
+
+    def _revalidate(self, key: K) -> None:
+        if key in self._inflight:
+            return
+        task = asyncio.create_task(self.refresh(key))
+        task.add_done_callback(_log_failure)
+
+    def set(self, key: K, value: V, age: float = 0.0) -> None:
+        self._entries[key] = (value, time.monotonic() - age)
+
+    def start(self, keys: Iterable[K] = ()) -> None:
+        if self._refresher is None:
+            self._refresher = asyncio.create_task(self._refresh_forever(list(keys)))
+
+    async def stop(self) -> None:
+        if self._refresher is not None:
+            self._refresher.cancel()
+            try:
+                await self._refresher
+            except asyncio.CancelledError:
+                pass
+            self._refresher = None
+
+    async def _refresh_forever(self, keys: list[K]) -> None:
+        while True:
+            for key in {*keys, *self._entries}:
+                age = self.age(key)
+                if age is not None and age < self.refresh_interval:
+                    continue
+                try:
+                    await self.refresh(key)
+                except Exception:
+                    logger.warning(
+                        "Background refresh failed for %r", key, exc_info=True
+                    )
+            next_due = min(
+                (self.refresh_interval - age for _, age in self._ages()),
+                default=self.refresh_interval,
+            )
+            await asyncio.sleep(max(next_due, self.refresh_interval / 10))
+
+    def _ages(self) -> list[tuple[K, float]]:
+        now = time.monotonic()
+        return [(key, now - t) for key, (_, t) in self._entries.items()]
+
+    def stats(self) -> CacheStatsDict:
+        return {
+            "hits": self._hits,
+            "misses": self._misses,
+            "stale_served": self._stale_served,
+            "refreshes": self._refreshes,
+            "refresh_errors": self._refresh_errors,
+            "shared_hits": self._shared_hits,
+            "ages": {str(key): round(age, 3) for key, age in self._ages()},
+        }
+
+
+class LruStatsDict(TypedDict):
+    hits: int
+    misses: int
+    evictions: int
+    entries: int
+    bytes: int
+
+
+class LruCache(Generic[K, V]):
+    def __init__(
+        self,
+        max_entries: int,
+        max_bytes: int | None = None,
+        sizeof: Callable[[V], int] = lambda _: 0,
+    ) -> None:
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._sizeof = sizeof
+        self._entries: OrderedDict[K, V] = OrderedDict()
+        self._bytes = 0
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, key: K) -> bool:
+        return key in self._entries
+
+    def get(self, key: K) -> V | None:
+        value = self._entries.get(key)
+        if value is None:
+            self._misses += 1
+            return None
+        self._hits += 1
+        self._entries.move_to_end(key)
+        return value
+
+    def put(self, key: K, value: V) -> None:
+        if key in self._entries:
+            self._bytes -= self._sizeof(self._entries.pop(key))
+        self._entries[key] = value
+        self._bytes += self._sizeof(value)
+        while self._entries and (
+            len(self._entries) > self.max_entries
+            or (self.max_bytes is not None and self._bytes > self.max_bytes)
+        ):
+            _, evicted = self._entries.popitem(last=False)
+            self._bytes -= self._sizeof(evicted)
+            self._evictions += 1
+
+    def stats(self) -> LruStatsDict:
+        return {
+            "hits": self._hits,
+            "misses": self._misses,
+            "evictions": self._evictions,
+            "entries": len(self._entries),
+            "bytes": self._bytes,
+        }
+
+
+class CoalescingStatsDict(TypedDict):
+    started: int
+    coalesced: int
+    replayed: int
+    entries: int
+
+
+class CoalescingCache(Generic[K, V]):
+    def __init__(self, max_entries: int) -> None:
+        self.max_entries = max_entries
+        self._results: OrderedDict[K, tuple[V, float]] = OrderedDict()
+        self._inflight: dict[K, asyncio.Task[V]] = {}
+        self._started = 0
+        self._coalesced = 0
+        self._replayed = 0
+
+    async def run(
+        self, key: K, factory: Callable[[], Awaitable[V]], ttl: float
+    ) -> tuple[V, bool]:
+        result = self._results.get(key)
+        if result is not None:
+            if time.monotonic() < result[1]:
+                self._replayed += 1
+                return result[0], True
+            del self._results[key]
+        task = self._inflight.get(key)
+        if task is not None:
+            self._coalesced += 1
+            return await asyncio.shield(task), True
+        self._started += 1
+        task = asyncio.create_task(self._complete(key, factory, ttl))
+        self._inflight[key] = task
+        task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        return await asyncio.shield(task), False
+
+    async def _complete(
+        self, key: K, factory: Callable[[], Awaitable[V]], ttl: float
+    ) -> V:
+        value = await factory()
+        self._results[key] = (value, time.monotonic() + ttl)
+        while len(self._results) > self.max_entries:
+            self._results.popitem(last=False)
+        return value
+
+    def stats(self) -> CoalescingStatsDict:
+        return {
+            "started": self._started,
+            "coalesced": self._coalesced,
+            "replayed": self._replayed,
+            "entries": len(self._results),
+        }
+
+
+def _log_failure(task: asyncio.Task) -> None:
+    if not task.cancelled() and task.exception() is not None:
+        logger.warning("Cache revalidation failed", exc_info=task.exception())
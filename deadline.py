@@ -0,0 +1,78 @@
+import asyncio
+import os
+import time
+from collections.abc import AsyncIterator, Iterator
+from contextlib import asynccontextmanager, contextmanager
+from contextvars import Context, ContextVar, copy_context
+
+INVOICE_DEADLINE = float(os.getenv("INVOICE_DEADLINE", "15"))
+INVOICE_DEADLINE_MAX = float(os.getenv("INVOICE_DEADLINE_MAX", "60"))
+DEADLINE_HEADER = "x-request-timeout"
+
+STAGE_SHARES = {"fx": 1.0, "rozo": 3.0, "lendasat": 4.0, "qr": 1.0}
+STAGES = tuple(STAGE_SHARES)
+
+_expires_at: ContextVar[float | None] = ContextVar("deadline", default=None)
+_stage_expires_at: ContextVar[float | None] = ContextVar("stage_deadline", default=None)
+
+
+class DeadlineExceededError(Exception):
+    def __init__(self, stage: str, budget: float | None = None) -> None:
+        self.stage = stage
+        self.budget = budget
+        detail = f" after {budget:.2f}s" if budget is not None else ""
+        super().__init__(f"Deadline exceeded in {stage}{detail}")
+
+
+@contextmanager
+def deadline(seconds: float) -> Iterator[None]:
+    if seconds <= 0:
+        yield
+        return
+    token = _expires_at.set(time.monotonic() + seconds)
+    try:
+        yield
+    finally:
+        _expires_at.reset(token)
+
+
+def remaining() -> float | None:
+    expiries = [e for e in (_expires_at.get(), _stage_expires_at.get()) if e]
+    if not expiries:
+        return None
+    return min(expiries) - time.monotonic()
+
+
+def stage_budget(stage: str) -> float | None:
+    expires_at = _expires_at.get()
+    if expires_at is None:
+        return None
+    shares = [STAGE_SHARES[s] for s in STAGES[STAGES.index(stage) :]]
+    return (expires_at - time.monotonic()) * STAGE_SHARES[stage] / sum(shares)
+
+
+@asynccontextmanager
+async def stage_deadline(stage: str) -> AsyncIterator[None]:
+    budget = stage_budget(stage)
+    if budget is None:
+        yield
+        return
+    if budget <= 0:
+        raise DeadlineExceededError(stage, 0.0)
+    token = _stage_expires_at.set(time.monotonic() + budget)
+    try:
+        async with asyncio.timeout(budget) as timeout:
+            yield
+    except TimeoutError:
+        if timeout.expired():
+            raise DeadlineExceededError(stage, budget) from None
+        raise
+    finally:
+        _stage_expires_at.reset(token)
+
+
+def without_deadline() -> Context:
+    context = copy_context()
+    context.run(_expires_at.set, None)
+    context.run(_stage_expires_at.set, None)
+    return context
@@ -0,0 +1,124 @@
+import os
+from typing import Any, TypedDict
+
+import httpx
+
+MAX_CONNECTIONS_PER_HOST = int(os.getenv("HTTP_MAX_CONNECTIONS_PER_HOST", "20"))
+MAX_KEEPALIVE_PER_HOST = int(os.getenv("HTTP_MAX_KEEPALIVE_PER_HOST", "10"))
+KEEPALIVE_EXPIRY = float(os.getenv("HTTP_KEEPALIVE_EXPIRY", "60"))
+CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", "5"))
+READ_TIMEOUT = float(os.getenv("HTTP_READ_TIMEOUT", "20"))
+POOL_TIMEOUT = float(os.getenv("HTTP_POOL_TIMEOUT", "5"))
+HTTP2 = os.getenv("HTTP_HTTP2", "0") == "1"
+
+
+class HostPoolStatsDict(TypedDict):
+    requests: int
+    connections_opened: int
+    reused: int
+    reuse_rate: float
+    open_connections: int
+    idle_connections: int
+
+
+class HostPoolTransport(httpx.AsyncBaseTransport):
+    def __init__(self, limits: httpx.Limits, http2: bool = False) -> None:
+        self._limits = limits
+        self._http2 = http2
+        self._pools: dict[str, httpx.AsyncHTTPTransport] = {}
+        self._requests: dict[str, int] = {}
+        self._connections: dict[str, int] = {}
+
+    def _pool_for(self, host: str) -> httpx.AsyncHTTPTransport:
+        pool = self._pools.get(host)
+        if pool is None:
+            pool = httpx.AsyncHTTPTransport(limits=self._limits, http2=self._http2)
+            self._pools[host] = pool
+            self._requests[host] = 0
+            self._connections[host] = 0
+        return pool
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        host = request.url.netloc.decode("ascii")
+        pool = self._pool_for(host)
+        self._requests[host] += 1
+        parent_trace = request.extensions.get("trace")
+
+        async def trace(event: str, info: dict[str, Any]) -> None:
+            if event == "connection.connect_tcp.complete":
+                self._connections[host] += 1
+            if parent_trace is not None:
+                await parent_trace(event, info)
+
+        request.extensions["trace"] = trace
+        return await pool.handle_async_request(request)
+
+    async def aclose(self) -> None:
+        for pool in self._pools.values():
+            await pool.aclose()
+        self._pools.clear()
+
+    def stats(self) -> dict[str, HostPoolStatsDict]:
+        stats: dict[str, HostPoolStatsDict] = {}
+        for host, pool in self._pools.items():
+            requests = self._requests[host]
+            opened = self._connections[host]
+            connections = getattr(getattr(pool, "_pool", None), "connections", [])
+            stats[host] = {
+                "requests": requests,
+                "connections_opened": opened,
+                "reused": max(requests - opened, 0),
+                "reuse_rate": round(1 - opened / requests, 4) if requests else 0.0,
+                "open_connections": len(connections),
+                "idle_connections": sum(1 for c in connections if c.is_idle()),
+            }
+        return stats
+
+
+_client: httpx.AsyncClient | None = None
+_transport: HostPoolTransport | None = None
+
+
+def default_transport() -> HostPoolTransport:
+    return HostPoolTransport(
+        httpx.Limits(
+            max_connections=MAX_CONNECTIONS_PER_HOST,
+            max_keepalive_connections=MAX_KEEPALIVE_PER_HOST,
+            keepalive_expiry=KEEPALIVE_EXPIRY,
+        ),
+        http2=HTTP2,
+    )
+
+
+def create_client(
+    transport: httpx.AsyncBaseTransport | None = None,
+) -> httpx.AsyncClient:
+    global _client, _transport
+    if transport is None:
+        _transport = default_transport()
+        transport = _transport
+    else:
+        _transport = transport if isinstance(transport, HostPoolTransport) else None
+    _client = httpx.AsyncClient(
+        transport=transport,
+        timeout=httpx.Timeout(READ_TIMEOUT, connect=CONNECT_TIMEOUT, pool=POOL_TIMEOUT),
+    )
+    return _client
+
+
+def get_client() -> httpx.AsyncClient:
+    if _client is None or _client.is_closed:
+        return create_client()
+    return _client
+
+
+async def close_client() -> None:
+    global _client, _transport
+    if _client is not None:
+        await _client.aclose()
+    _client = None
+    _transport = None
+
+
+def pool_stats() -> dict[str, HostPoolStatsDict]:
+    return _transport.stats() if _transport is not None else {}
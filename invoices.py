@@ -0,0 +1,218 @@
+import json
+import os
+import time
+from collections.abc import Awaitable, Callable
+from typing import TypedDict
+
+from cache import CoalescingCache, LruCache
+from deadline import INVOICE_DEADLINE_MAX, stage_deadline
+from journal import swap_journal
+from shared_cache import SharedTier, shared_store
+from metrics import observe_stage
+from tracing import tracer
+from lendasat import create_lightning_invoice, estimate_sats, latest_price
+from lendasat import upstream as lendasat_upstream
+from tracker import status_tracker
+from rozo import (
+    convert_local_to_usd,
+    create_rozo_payment_intent,
+    merchant_label,
+    parse_payment_response,
+)
+from rozo import upstream as rozo_upstream
+
+INVOICE_CACHE_SIZE = int(os.getenv("INVOICE_CACHE_SIZE", "10000"))
+IDEMPOTENCY_TTL = float(os.getenv("IDEMPOTENCY_TTL", "3600"))
+IDEMPOTENCY_WINDOW = float(os.getenv("IDEMPOTENCY_WINDOW", "10"))
+INVOICE_SHARED_TTL = float(os.getenv("INVOICE_SHARED_TTL", "86400"))
+
+
+class InvoiceDict(TypedDict):
+    id: str
+    invoice: str
+    sats: int
+    service: str
+    amount: float
+    usd_amount: float
+    receiving_address: str
+    hash_lock: str
+    rozo_payment_id: str
+    created_at: float
+    expires_at: int
+
+
+class QuoteDict(TypedDict):
+    service: str
+    amount: float
+    usd_amount: float
+    sats: int
+    usd_per_sat: float
+    price_age: float
+
+
+ProgressCallback = Callable[[str, dict[str, str | int | float]], None]
+
+
+class IdempotencyKeyReusedError(Exception):
+    pass
+
+
+issued_invoices: LruCache[str, InvoiceDict] = LruCache(INVOICE_CACHE_SIZE)
+shared_invoices: SharedTier[InvoiceDict] = SharedTier(
+    shared_store, "invoice", lambda invoice: json.dumps(invoice).encode(), json.loads
+)
+invoice_requests: CoalescingCache[tuple[str, ...], tuple[InvoiceDict, bool]] = (
+    CoalescingCache(INVOICE_CACHE_SIZE)
+)
+idempotency_keys: SharedTier[str] = SharedTier(
+    shared_store, "idempotency", str.encode, bytes.decode
+)
+
+
+async def issue_invoice(
+    service: str,
+    amount: float,
+    rates: dict[str, float] | None = None,
+    on_progress: ProgressCallback | None = None,
+) -> InvoiceDict:
+    merchant = merchant_label(service)
+    with observe_stage("fx", merchant), tracer.span("fx", batched=rates is not None):
+        async with stage_deadline("fx"):
+            usd_amount = await convert_local_to_usd(service, amount, rates)
+    if on_progress is not None:
+        on_progress("usd", {"amount": amount, "usd_amount": usd_amount})
+    lendasat_upstream.ensure_available()
+    rozo_upstream.ensure_available()
+    with observe_stage("rozo", merchant), tracer.span("rozo.create_payment") as span:
+        async with stage_deadline("rozo"):
+            payment = await create_rozo_payment_intent(service, amount, usd_amount)
+        span["payment_id"] = payment["id"]
+    receiving_address, usdc_amount = parse_payment_response(payment)
+    if on_progress is not None:
+        on_progress(
+            "rozo", {"receiving_address": receiving_address, "usd_amount": usdc_amount}
+        )
+    with (
+        observe_stage("lendasat", merchant),
+        tracer.span("lendasat.create_invoice") as span,
+    ):
+        async with stage_deadline("lendasat"):
+            swap, preimage, bolt11 = await create_lightning_invoice(
+                receiving_address, usdc_amount
+            )
+        span["swap_id"] = swap["id"]
+        span["sats"] = swap["sats_required"]
+    invoice: InvoiceDict = {
+        "id": swap["id"],
+        "invoice": swap["ln_invoice"],
+        "sats": swap["sats_required"],
+        "service": service,
+        "amount": amount,
+        "usd_amount": usdc_amount,
+        "receiving_address": receiving_address,
+        "hash_lock": swap["hash_lock"],
+        "rozo_payment_id": payment["id"],
+        "created_at": time.time(),
+        "expires_at": bolt11["expires_at"],
+    }
+    with observe_stage("journal", merchant), tracer.span("journal"):
+        await swap_journal.append(
+            {
+                "swap_id": invoice["id"],
+                "hash_lock": invoice["hash_lock"],
+                "preimage": preimage,
+                "rozo_payment_id": invoice["rozo_payment_id"],
+                "receiving_address": receiving_address,
+                "service": service,
+                "local_amount": amount,
+                "usd_amount": usdc_amount,
+                "sats": invoice["sats"],
+                "ln_invoice": invoice["invoice"],
+                "created_at": invoice["created_at"],
+            }
+        )
+    issued_invoices.put(invoice["id"], invoice)
+    await shared_invoices.put(
+        invoice["id"],
+        invoice,
+        min(INVOICE_SHARED_TTL, max(invoice["expires_at"] - invoice["created_at"], 1)),
+    )
+    status_tracker.track(
+        invoice["id"], invoice["rozo_payment_id"], invoice["expires_at"]
+    )
+    return invoice
+
+
+async def find_invoice(invoice_id: str) -> InvoiceDict | None:
+    invoice = issued_invoices.get(invoice_id)
+    if invoice is None:
+        invoice = await shared_invoices.get(invoice_id)
+        if invoice is not None:
+            issued_invoices.put(invoice_id, invoice)
+    return invoice
+
+
+async def issue_shared(
+    key: str, ttl: float, issue: Callable[[], Awaitable[InvoiceDict]]
+) -> tuple[InvoiceDict, bool]:
+    issued: list[InvoiceDict] = []
+
+    async def issue_id() -> str:
+        issued.append(await issue())
+        return issued[0]["id"]
+
+    invoice_id, _ = await idempotency_keys.load(
+        key, ttl, issue_id, ttl=ttl, lease_timeout=INVOICE_DEADLINE_MAX
+    )
+    if issued:
+        return issued[0], False
+    invoice = await find_invoice(invoice_id)
+    if invoice is None:
+        raise IdempotencyKeyReusedError(
+            "The invoice for this idempotency key has expired"
+        )
+    return invoice, True
+
+
+async def issue_invoice_once(
+    service: str,
+    amount: float,
+    idempotency_key: str | None,
+    client: str,
+    rates: dict[str, float] | None = None,
+    on_progress: ProgressCallback | None = None,
+) -> tuple[InvoiceDict, bool]:
+    if idempotency_key:
+        key, ttl = ("key", idempotency_key), IDEMPOTENCY_TTL
+    else:
+        key, ttl = ("auto", service, repr(amount), client), IDEMPOTENCY_WINDOW
+    (invoice, shared_replay), replayed = await invoice_requests.run(
+        key,
+        lambda: issue_shared(
+            json.dumps(key),
+            ttl,
+            lambda: issue_invoice(service, amount, rates, on_progress),
+        ),
+        ttl,
+    )
+    replayed = replayed or shared_replay
+    if invoice["service"] != service or invoice["amount"] != amount:
+        raise IdempotencyKeyReusedError(
+            "Idempotency key was already used for a different request"
+        )
+    return invoice, replayed
+
+
+async def quote_invoice(service: str, amount: float) -> QuoteDict | None:
+    price = latest_price()
+    if price is None:
+        return None
+    usd_amount = await convert_local_to_usd(service, amount)
+    return {
+        "service": service,
+        "amount": amount,
+        "usd_amount": usd_amount,
+        "sats": estimate_sats(usd_amount, price),
+        "usd_per_sat": price["usd_per_sat"],
+        "price_age": round(time.time() - price["observed_at"], 3),
+    }
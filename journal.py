@@ -0,0 +1,191 @@
+import asyncio
+import logging
+import os
+import queue
+import sqlite3
+import threading
+import time
+from typing import TypedDict
+
+logger = logging.getLogger(__name__)
+
+JOURNAL_PATH = os.getenv("SWAP_JOURNAL_PATH", "swaps.db")
+JOURNAL_BATCH_SIZE = int(os.getenv("SWAP_JOURNAL_BATCH_SIZE", "64"))
+JOURNAL_BATCH_DELAY = float(os.getenv("SWAP_JOURNAL_BATCH_DELAY", "0.002"))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS swaps (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    swap_id TEXT NOT NULL UNIQUE,
+    hash_lock TEXT NOT NULL,
+    preimage TEXT NOT NULL,
+    rozo_payment_id TEXT NOT NULL,
+    receiving_address TEXT NOT NULL,
+    service TEXT NOT NULL,
+    local_amount REAL NOT NULL,
+    usd_amount REAL NOT NULL,
+    sats INTEGER NOT NULL,
+    ln_invoice TEXT NOT NULL,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS swaps_hash_lock ON swaps (hash_lock);
+CREATE INDEX IF NOT EXISTS swaps_receiving_address ON swaps (receiving_address);
+"""
+
+COLUMNS = (
+    "swap_id",
+    "hash_lock",
+    "preimage",
+    "rozo_payment_id",
+    "receiving_address",
+    "service",
+    "local_amount",
+    "usd_amount",
+    "sats",
+    "ln_invoice",
+    "created_at",
+)
+
+
+class SwapRecordDict(TypedDict):
+    swap_id: str
+    hash_lock: str
+    preimage: str
+    rozo_payment_id: str
+    receiving_address: str
+    service: str
+    local_amount: float
+    usd_amount: float
+    sats: int
+    ln_invoice: str
+    created_at: float
+
+
+class JournalStatsDict(TypedDict):
+    appended: int
+    batches: int
+    pending: int
+    avg_batch_size: float
+    last_commit_ms: float
+
+
+_Pending = tuple[SwapRecordDict, asyncio.Future[None], asyncio.AbstractEventLoop]
+
+
+def connect(path: str = JOURNAL_PATH) -> sqlite3.Connection:
+    conn = sqlite3.connect(path, check_same_thread=False)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=FULL")
+    conn.executescript(SCHEMA)
+    if path != ":memory:":
+        os.chmod(path, 0o600)
+    return conn
+
+
+class SwapJournal:
+    def __init__(
+        self,
+        path: str = JOURNAL_PATH,
+        batch_size: int = JOURNAL_BATCH_SIZE,
+        batch_delay: float = JOURNAL_BATCH_DELAY,
+    ) -> None:
+        self.path = path
+        self.batch_size = batch_size
+        self.batch_delay = batch_delay
+        self._queue: queue.Queue[_Pending | None] = queue.Queue()
+        self._thread: threading.Thread | None = None
+        self._appended = 0
+        self._batches = 0
+        self._last_commit_ms = 0.0
+
+    def open(self) -> None:
+        if self._thread is not None:
+            return
+        conn = connect(self.path)
+        self._thread = threading.Thread(
+            target=self._run, args=(conn,), name="swap-journal", daemon=True
+        )
+        self._thread.start()
+
+    def close(self) -> None:
+        if self._thread is None:
+            return
+        self._queue.put(None)
+        self._thread.join()
+        self._thread = None
+
+    async def append(self, record: SwapRecordDict) -> None:
+        if self._thread is None:
+            self.open()
+        loop = asyncio.get_running_loop()
+        future: asyncio.Future[None] = loop.create_future()
+        self._queue.put((record, future, loop))
+        await future
+
+    def _next_batch(self) -> tuple[list[_Pending], bool]:
+        first = self._queue.get()
+        if first is None:
+            return [], True
+        batch = [first]
+        deadline = time.monotonic() + self.batch_delay
+        while len(batch) < self.batch_size:
+            try:
+                item = self._queue.get(timeout=max(deadline - time.monotonic(), 0))
+            except queue.Empty:
+                break
+            if item is None:
+                return batch, True
+            batch.append(item)
+        return batch, False
+
+    def _run(self, conn: sqlite3.Connection) -> None:
+        sql = (
+            f"INSERT OR IGNORE INTO swaps ({', '.join(COLUMNS)}) "
+            f"VALUES ({', '.join('?' * len(COLUMNS))})"
+        )
+        closing = False
+        while not closing:
+            batch, closing = self._next_batch()
+            if not batch:
+                continue
+            start = time.perf_counter()
+            try:
+                with conn:
+                    conn.executemany(
+                        sql, [[r[c] for c in COLUMNS] for r, _, _ in batch]
+                    )
+            except Exception as e:
+                logger.exception("Swap journal commit failed")
+                for _, future, loop in batch:
+                    loop.call_soon_threadsafe(_settle, future, e)
+                continue
+            self._last_commit_ms = (time.perf_counter() - start) * 1000
+            self._appended += len(batch)
+            self._batches += 1
+            for _, future, loop in batch:
+                loop.call_soon_threadsafe(_settle, future, None)
+        conn.close()
+
+    def stats(self) -> JournalStatsDict:
+        return {
+            "appended": self._appended,
+            "batches": self._batches,
+            "pending": self._queue.qsize(),
+            "avg_batch_size": round(self._appended / self._batches, 2)
+            if self._batches
+            else 0.0,
+            "last_commit_ms": round(self._last_commit_ms, 3),
+        }
+
+
+def _settle(future: asyncio.Future[None], error: Exception | None) -> None:
+    if future.done():
+        return
+    if error is None:
+        future.set_result(None)
+    else:
+        future.set_exception(error)
+
+
+swap_journal = SwapJournal()
@@ -1,12 +1,41 @@
-import httpx
 import secrets
 import hashlib
 import os
-from typing import TypedDict
+import time
+from collections import deque
+from statistics import median
+from typing import NotRequired, TypedDict
+from bolt11 import Bolt11Dict, Bolt11Error, decode as decode_bolt11
+from http_client import get_client
+from resilience import Upstream
 
 API_URL = "https://apilendaswap.lendasat.com/swap"
 REFERRAL_CODE = os.getenv("LENDASAT_REFERRAL_CODE")
 REFUND_PK = "024b4b4b4f6e4e4593fd430ec04f23f6b56276f1a8e4280d5988b326374aee050a"
+PAID_SWAP_STATUSES = {
+    "clientfunded",
+    "serverfunded",
+    "clientredeemed",
+    "serverredeemed",
+}
+FAILED_SWAP_STATUSES = {
+    "expired",
+    "clientrefunded",
+    "clientinvalidfunded",
+    "clientfundedtoolate",
+    "clientfundedserverrefunded",
+    "clientrefundedserverfunded",
+    "clientrefundedserverrefunded",
+}
+PRICE_SAMPLES = int(os.getenv("LENDASAT_PRICE_SAMPLES", "20"))
+PRICE_MAX_AGE = float(os.getenv("LENDASAT_PRICE_MAX_AGE", "900"))
+
+
+upstream = Upstream("lendasat")
+
+
+class InvoiceMismatchError(ValueError):
+    pass
 
 
 class SwapSecret(TypedDict):
@@ -16,6 +45,7 @@ class SwapSecret(TypedDict):
 
 class LendasatResponse(TypedDict):
     id: str
+    status: NotRequired[str]
     polygon_address: str
     arkade_address: str
     ln_invoice: str
@@ -34,6 +64,63 @@ class LendasatResponse(TypedDict):
     network: str
 
 
+class PriceSampleDict(TypedDict):
+    usd_per_sat: float
+    fee_rate: float
+    observed_at: float
+
+
+recent_prices: deque[PriceSampleDict] = deque(maxlen=PRICE_SAMPLES)
+
+
+def record_price(swap: LendasatResponse) -> None:
+    base_sats = swap["sats_required"] - swap["fee_sats"]
+    if swap["usd_per_sat"] <= 0 or base_sats <= 0:
+        return
+    recent_prices.append(
+        {
+            "usd_per_sat": swap["usd_per_sat"],
+            "fee_rate": swap["fee_sats"] / base_sats,
+            "observed_at": time.time(),
+        }
+    )
+
+
+def latest_price() -> PriceSampleDict | None:
+    cutoff = time.time() - PRICE_MAX_AGE
+    fresh = [p for p in recent_prices if p["observed_at"] >= cutoff]
+    if not fresh:
+        return None
+    return {
+        "usd_per_sat": median(p["usd_per_sat"] for p in fresh),
+        "fee_rate": median(p["fee_rate"] for p in fresh),
+        "observed_at": fresh[-1]["observed_at"],
+    }
+
+
+def estimate_sats(usd_amount: float, price: PriceSampleDict) -> int:
+    return round(usd_amount / price["usd_per_sat"] * (1 + price["fee_rate"]))
+
+
+def verify_invoice(swap: LendasatResponse, hash_lock: str) -> Bolt11Dict:
+    try:
+        invoice = decode_bolt11(swap["ln_invoice"])
+    except Bolt11Error as e:
+        raise InvoiceMismatchError(
+            f"Swap {swap['id']} invoice is malformed: {e}"
+        ) from e
+    if invoice["payment_hash"] != hash_lock.removeprefix("0x"):
+        raise InvoiceMismatchError(
+            f"Swap {swap['id']} invoice does not pay to our hash lock"
+        )
+    if invoice["amount_msat"] != swap["sats_required"] * 1000:
+        raise InvoiceMismatchError(
+            f"Swap {swap['id']} invoice amount {invoice['amount_msat']} msat "
+            f"does not match {swap['sats_required']} sats required"
+        )
+    return invoice
+
+
 def generate_hash_lock() -> SwapSecret:
     preimage = secrets.token_bytes(32)
     hash_lock = "0x" + hashlib.sha256(preimage).hexdigest()
@@ -42,7 +129,7 @@ def generate_hash_lock() -> SwapSecret:
 
 async def create_lightning_invoice(
     polygon_address: str, usd_amount: float
-) -> tuple[LendasatResponse, str]:
+) -> tuple[LendasatResponse, str, Bolt11Dict]:
     secret = generate_hash_lock()
     payload = {
         "polygon_address": polygon_address,
@@ -53,17 +140,27 @@ async def create_lightning_invoice(
         "referral_code": REFERRAL_CODE,
     }
 
-    async with httpx.AsyncClient() as client:
-        response = await client.post(API_URL, json=payload)
+    response = await upstream.call(lambda: get_client().post(API_URL, json=payload))
+
+    response.raise_for_status()
+    swap: LendasatResponse = response.json()
+    invoice = verify_invoice(swap, secret["hash_lock"])
+    record_price(swap)
+    return swap, secret["preimage"], invoice
 
+
+async def get_swap(swap_id: str) -> LendasatResponse:
+    response = await upstream.call(
+        lambda: get_client().get(f"{API_URL}/{swap_id}"), idempotent=True
+    )
     response.raise_for_status()
-    return response.json(), secret["preimage"]
+    return response.json()
 
 
 async def create_ln_payment_for_rozo(
     receiving_address: str, usd_amount: float
 ) -> tuple[str, str, int]:
-    invoice_data, preimage = await create_lightning_invoice(
+    invoice_data, preimage, _ = await create_lightning_invoice(
         receiving_address, usd_amount
     )
     return invoice_data["ln_invoice"], preimage, invoice_data["sats_required"]
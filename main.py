@@ -1,6 +1,57 @@
+import argparse
 import asyncio
-from rozo import create_rozo_payment
-from lendasat import create_ln_payment_for_rozo
+import csv
+import json
+import os
+import sys
+import time
+from collections.abc import Iterator
+from typing import IO, TypedDict, cast
+from rozo import (
+    create_rozo_payment,
+    create_rozo_payment_intent,
+    parse_payment_response,
+)
+from lendasat import create_ln_payment_for_rozo, create_lightning_invoice
+from http_client import close_client
+from journal import swap_journal
+
+BULK_CONCURRENCY = int(os.getenv("BULK_CONCURRENCY", "8"))
+RESULT_FIELDS = (
+    "line",
+    "merchant_id",
+    "amount",
+    "usd_amount",
+    "rozo_payment_id",
+    "receiving_address",
+    "swap_id",
+    "sats",
+    "invoice",
+    "hash_lock",
+    "preimage",
+    "error",
+)
+
+
+class BulkRowDict(TypedDict):
+    line: int
+    merchant_id: str
+    amount: float
+
+
+class BulkResultDict(TypedDict, total=False):
+    line: int
+    merchant_id: str
+    amount: float
+    usd_amount: float
+    rozo_payment_id: str
+    receiving_address: str
+    swap_id: str
+    sats: int
+    invoice: str
+    hash_lock: str
+    preimage: str
+    error: str
 
 
 async def main() -> None:
@@ -19,5 +70,192 @@ async def main() -> None:
     print(f"Preimage (keep safe!): {preimage}")
 
 
+def invalid_row(number: int, e: Exception) -> BulkResultDict:
+    return {"line": number, "error": f"Invalid row: {type(e).__name__}: {e}"}
+
+
+def read_rows(stream: IO[str], fmt: str) -> Iterator[BulkRowDict | BulkResultDict]:
+    lines = [(number, line) for number, line in enumerate(stream, 1) if line.strip()]
+    if not lines:
+        return
+    if fmt == "auto":
+        fmt = "jsonl" if lines[0][1].lstrip().startswith("{") else "csv"
+    if fmt == "jsonl":
+        for number, line in lines:
+            try:
+                row = json.loads(line)
+                merchant_id, amount = str(row["merchant_id"]), float(row["amount"])
+            except (ValueError, KeyError, TypeError) as e:
+                yield invalid_row(number, e)
+                continue
+            yield {"line": number, "merchant_id": merchant_id, "amount": amount}
+        return
+    records = csv.reader(line for _, line in lines)
+    for (number, _), record in zip(lines, records):
+        fields = [field.strip() for field in record]
+        if number == lines[0][0] and fields and fields[0].lower() == "merchant_id":
+            continue
+        try:
+            merchant_id, value = fields[:2]
+            amount = float(value)
+        except ValueError as e:
+            yield invalid_row(number, e)
+            continue
+        yield {"line": number, "merchant_id": merchant_id, "amount": amount}
+
+
+async def issue(row: BulkRowDict) -> BulkResultDict:
+    result: BulkResultDict = {
+        "line": row["line"],
+        "merchant_id": row["merchant_id"],
+        "amount": row["amount"],
+    }
+    try:
+        payment = await create_rozo_payment_intent(row["merchant_id"], row["amount"])
+        receiving_address, usdc_amount = parse_payment_response(payment)
+        result["rozo_payment_id"] = payment["id"]
+        result["usd_amount"] = usdc_amount
+        result["receiving_address"] = receiving_address
+        swap, preimage, _ = await create_lightning_invoice(
+            receiving_address, usdc_amount
+        )
+        await swap_journal.append(
+            {
+                "swap_id": swap["id"],
+                "hash_lock": swap["hash_lock"],
+                "preimage": preimage,
+                "rozo_payment_id": payment["id"],
+                "receiving_address": receiving_address,
+                "service": row["merchant_id"],
+                "local_amount": row["amount"],
+                "usd_amount": usdc_amount,
+                "sats": swap["sats_required"],
+                "ln_invoice": swap["ln_invoice"],
+                "created_at": time.time(),
+            }
+        )
+    except Exception as e:
+        result["error"] = f"{type(e).__name__}: {e}"
+        return result
+    result["swap_id"] = swap["id"]
+    result["sats"] = swap["sats_required"]
+    result["invoice"] = swap["ln_invoice"]
+    result["hash_lock"] = swap["hash_lock"]
+    result["preimage"] = preimage
+    return result
+
+
+def open_output(path: str) -> IO[str]:
+    if path == "-":
+        return sys.stdout
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    return os.fdopen(fd, "w", newline="")
+
+
+async def bulk(args: argparse.Namespace) -> None:
+    if args.input == "-":
+        rows = list(read_rows(sys.stdin, args.input_format))
+    else:
+        with open(args.input, newline="") as f:
+            rows = list(read_rows(f, args.input_format))
+    out_format = args.output_format
+    if out_format == "auto":
+        out_format = "csv" if args.output.endswith(".csv") else "jsonl"
+
+    semaphore = asyncio.Semaphore(args.concurrency)
+    latencies: list[float] = []
+
+    async def run_row(row: BulkRowDict | BulkResultDict) -> BulkResultDict:
+        if "error" in row:
+            return cast(BulkResultDict, row)
+        async with semaphore:
+            start = time.perf_counter()
+            result = await issue(cast(BulkRowDict, row))
+            latencies.append(time.perf_counter() - start)
+            return result
+
+    ok = failed = 0
+    started = last_report = time.perf_counter()
+    out = open_output(args.output)
+    try:
+        writer = csv.DictWriter(out, RESULT_FIELDS) if out_format == "csv" else None
+        if writer is not None:
+            writer.writeheader()
+        tasks = [asyncio.create_task(run_row(row)) for row in rows]
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                result = await next_done
+                if writer is not None:
+                    writer.writerow(result)
+                else:
+                    out.write(json.dumps(result) + "\n")
+                out.flush()
+                if "error" in result:
+                    failed += 1
+                else:
+                    ok += 1
+                now = time.perf_counter()
+                if now - last_report >= 1:
+                    last_report = now
+                    print(
+                        f"{ok + failed}/{len(rows)} done "
+                        f"({(ok + failed) / (now - started):.1f}/s, {failed} failed)",
+                        file=sys.stderr,
+                    )
+        finally:
+            for task in tasks:
+                task.cancel()
+    finally:
+        if out is not sys.stdout:
+            out.close()
+
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+    p50 = latencies[len(latencies) // 2] if latencies else 0.0
+    p95 = (
+        latencies[min(int(len(latencies) * 0.95), len(latencies) - 1)]
+        if latencies
+        else 0.0
+    )
+    print(
+        f"{ok} issued, {failed} failed in {elapsed:.1f}s "
+        f"({len(rows) / elapsed if elapsed else 0:.1f}/s, "
+        f"p50 {p50 * 1000:.0f} ms, p95 {p95 * 1000:.0f} ms)",
+        file=sys.stderr,
+    )
+
+
+async def run(args: argparse.Namespace | None = None) -> None:
+    try:
+        if args is not None and args.input is not None:
+            await bulk(args)
+        else:
+            await main()
+    finally:
+        await close_client()
+        swap_journal.close()
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="Create Rozo payments with Lightning invoices. Without an "
+        "input file, creates a single cafe payment."
+    )
+    parser.add_argument(
+        "input", nargs="?", help="CSV or JSONL of merchant_id,amount rows (- for stdin)"
+    )
+    parser.add_argument(
+        "-o", "--output", default="-", help="Result file (- for stdout)"
+    )
+    parser.add_argument("-c", "--concurrency", type=int, default=BULK_CONCURRENCY)
+    parser.add_argument(
+        "--input-format", choices=["auto", "csv", "jsonl"], default="auto"
+    )
+    parser.add_argument(
+        "--output-format", choices=["auto", "csv", "jsonl"], default="auto"
+    )
+    return parser.parse_args()
+
+
 if __name__ == "__main__":
-    asyncio.run(main())
+    asyncio.run(run(parse_args()))
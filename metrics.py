@@ -0,0 +1,111 @@
+import time
+from bisect import bisect_left
+from collections.abc import Iterator
+from contextlib import contextmanager
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+REGISTRY: list["Counter | Histogram"] = []
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(names: tuple[str, ...], values: tuple[str, ...], **extra: str) -> str:
+    pairs = [*zip(names, values), *extra.items()]
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+def _number(value: float) -> str:
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+class Counter:
+    def __init__(
+        self, name: str, description: str, labelnames: tuple[str, ...] = ()
+    ) -> None:
+        self.name = name
+        self.description = description
+        self.labelnames = labelnames
+        self._values: dict[tuple[str, ...], float] = {}
+        REGISTRY.append(self)
+
+    def inc(self, *labels: str, amount: float = 1.0) -> None:
+        self._values[labels] = self._values.get(labels, 0.0) + amount
+
+    def render(self) -> Iterator[str]:
+        yield f"# HELP {self.name} {self.description}"
+        yield f"# TYPE {self.name} counter"
+        for labels, value in self._values.items():
+            yield f"{self.name}{_labels(self.labelnames, labels)} {_number(value)}"
+
+
+class Histogram:
+    def __init__(
+        self,
+        name: str,
+        description: str,
+        labelnames: tuple[str, ...] = (),
+        buckets: tuple[float, ...] = DEFAULT_BUCKETS,
+    ) -> None:
+        self.name = name
+        self.description = description
+        self.labelnames = labelnames
+        self.buckets = buckets
+        self._series: dict[tuple[str, ...], tuple[list[int], list[float]]] = {}
+        REGISTRY.append(self)
+
+    def observe(self, value: float, *labels: str) -> None:
+        series = self._series.get(labels)
+        if series is None:
+            series = self._series[labels] = ([0] * (len(self.buckets) + 1), [0.0])
+        series[0][bisect_left(self.buckets, value)] += 1
+        series[1][0] += value
+
+    def render(self) -> Iterator[str]:
+        yield f"# HELP {self.name} {self.description}"
+        yield f"# TYPE {self.name} histogram"
+        for labels, (counts, total) in self._series.items():
+            cumulative = 0
+            for bound, count in zip((*self.buckets, float("inf")), counts):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else _number(bound)
+                yield (
+                    f"{self.name}_bucket"
+                    f"{_labels(self.labelnames, labels, le=le)} {cumulative}"
+                )
+            label_str = _labels(self.labelnames, labels)
+            yield f"{self.name}_sum{label_str} {_number(total[0])}"
+            yield f"{self.name}_count{label_str} {cumulative}"
+
+
+def render() -> str:
+    return "\n".join(line for metric in REGISTRY for line in metric.render()) + "\n"
+
+
+stage_seconds = Histogram(
+    "invoice_stage_seconds",
+    "Latency of invoice pipeline stages",
+    ("stage", "merchant", "outcome"),
+)
+stage_errors = Counter(
+    "invoice_stage_errors_total",
+    "Failed invoice pipeline stages by error type",
+    ("stage", "merchant", "error"),
+)
+
+
+@contextmanager
+def observe_stage(stage: str, merchant: str) -> Iterator[None]:
+    start = time.perf_counter()
+    try:
+        yield
+    except BaseException as e:
+        stage_seconds.observe(time.perf_counter() - start, stage, merchant, "error")
+        stage_errors.inc(stage, merchant, type(e).__name__)
+        raise
+    stage_seconds.observe(time.perf_counter() - start, stage, merchant, "ok")
@@ -0,0 +1,142 @@
+import asyncio
+import multiprocessing
+import os
+import struct
+import zlib
+from collections.abc import Callable
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+
+from cache import LruCache
+from tracing import tracer
+
+QR_POOL_KIND = os.getenv("QR_POOL_KIND", "process")
+QR_POOL_SIZE = int(os.getenv("QR_POOL_SIZE", "2"))
+QR_PNG_BOX_SIZE = int(os.getenv("QR_PNG_BOX_SIZE", "4"))
+QR_CACHE_MAX_ENTRIES = int(os.getenv("QR_CACHE_MAX_ENTRIES", "2000"))
+QR_CACHE_MAX_BYTES = int(os.getenv("QR_CACHE_MAX_BYTES", str(16 * 1024 * 1024)))
+
+MEDIA_TYPES = {"png": "image/png", "svg": "image/svg+xml"}
+
+
+def qr_matrix(data: str) -> list[list[bool]]:
+    import qrcode
+
+    qr = qrcode.QRCode(version=1, border=2)
+    qr.add_data(data)
+    qr.make(fit=True)
+    return qr.get_matrix()
+
+
+def _png_chunk(kind: bytes, data: bytes) -> bytes:
+    return (
+        struct.pack(">I", len(data))
+        + kind
+        + data
+        + struct.pack(">I", zlib.crc32(kind + data))
+    )
+
+
+def encode_png(matrix: list[list[bool]], box_size: int = QR_PNG_BOX_SIZE) -> bytes:
+    size = len(matrix) * box_size
+    raw = bytearray()
+    for row in matrix:
+        bits = "".join("0" * box_size if dark else "1" * box_size for dark in row)
+        bits = bits.ljust(-(-size // 8) * 8, "1")
+        line = b"\x00" + int(bits, 2).to_bytes(len(bits) // 8, "big")
+        raw += line * box_size
+    header = struct.pack(">IIBBBBB", size, size, 1, 0, 0, 0, 0)
+    return (
+        b"\x89PNG\r\n\x1a\n"
+        + _png_chunk(b"IHDR", header)
+        + _png_chunk(b"IDAT", zlib.compress(bytes(raw), 9))
+        + _png_chunk(b"IEND", b"")
+    )
+
+
+def encode_svg(matrix: list[list[bool]]) -> bytes:
+    size = len(matrix)
+    runs = []
+    for y, row in enumerate(matrix):
+        x = 0
+        while x < size:
+            if not row[x]:
+                x += 1
+                continue
+            start = x
+            while x < size and row[x]:
+                x += 1
+            runs.append(f"M{start} {y}.5h{x - start}")
+    return (
+        f'<svg xmlns="http://www.w3.org/2000/svg" viewBox="0 0 {size} {size}" '
+        f'shape-rendering="crispEdges"><rect width="{size}" height="{size}" '
+        f'fill="#fff"/><path stroke="#000" d="{"".join(runs)}"/></svg>'
+    ).encode()
+
+
+def render_png(data: str) -> bytes:
+    return encode_png(qr_matrix(data))
+
+
+def render_svg(data: str) -> bytes:
+    return encode_svg(qr_matrix(data))
+
+
+ENGINES: dict[str, Callable[[str], bytes]] = {"png": render_png, "svg": render_svg}
+
+
+class QrRenderer:
+    def __init__(
+        self,
+        engines: dict[str, Callable[[str], bytes]] = ENGINES,
+        kind: str = QR_POOL_KIND,
+        size: int = QR_POOL_SIZE,
+    ) -> None:
+        if kind not in ("process", "thread", "inline"):
+            raise ValueError(f"Unknown QR pool kind: {kind}")
+        self.engines = engines
+        self.kind = kind
+        self.size = size
+        self._executor: Executor | None = None
+
+    def start(self) -> None:
+        if self._executor is not None or self.kind == "inline":
+            return
+        if self.kind == "process":
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.size, mp_context=multiprocessing.get_context("spawn")
+            )
+            self._executor.submit(qr_matrix, "")
+        else:
+            self._executor = ThreadPoolExecutor(
+                max_workers=self.size, thread_name_prefix="qr"
+            )
+
+    def shutdown(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    async def render(self, data: str, fmt: str = "png") -> bytes:
+        engine = self.engines[fmt]
+        if self.kind == "inline":
+            return engine(data)
+        if self._executor is None:
+            self.start()
+        return await asyncio.get_running_loop().run_in_executor(
+            self._executor, engine, data
+        )
+
+
+qr_renderer = QrRenderer()
+qr_images: LruCache[tuple[str, str], bytes] = LruCache(
+    QR_CACHE_MAX_ENTRIES, QR_CACHE_MAX_BYTES, sizeof=len
+)
+
+
+async def qr_image(key: str, data: str, fmt: str) -> bytes:
+    image = qr_images.get((key, fmt))
+    if image is None:
+        with tracer.span("qr.render", fmt=fmt, pool=qr_renderer.kind):
+            image = await qr_renderer.render(data, fmt)
+        qr_images.put((key, fmt), image)
+    return image
@@ -0,0 +1,75 @@
+import math
+import os
+import time
+from collections import OrderedDict
+from typing import TypedDict
+
+from metrics import Counter
+
+RATE_LIMIT_PER_MINUTE = float(os.getenv("RATE_LIMIT_PER_MINUTE", "0"))
+RATE_LIMIT_BURST = float(os.getenv("RATE_LIMIT_BURST", "10"))
+RATE_LIMIT_MAX_CLIENTS = int(os.getenv("RATE_LIMIT_MAX_CLIENTS", "10000"))
+
+rate_limited = Counter(
+    "rate_limited_total", "Requests rejected by the per-client rate limiter"
+)
+
+
+class RateLimiterStatsDict(TypedDict):
+    enabled: bool
+    clients: int
+    allowed: int
+    limited: int
+
+
+class RateLimiter:
+    def __init__(
+        self,
+        per_minute: float = RATE_LIMIT_PER_MINUTE,
+        burst: float = RATE_LIMIT_BURST,
+        max_clients: int = RATE_LIMIT_MAX_CLIENTS,
+    ) -> None:
+        self.rate = per_minute / 60
+        self.burst = burst
+        self.max_clients = max_clients
+        self._buckets: OrderedDict[str, tuple[float, float]] = OrderedDict()
+        self._allowed = 0
+        self._limited = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.rate > 0
+
+    def acquire(self, client: str, cost: float = 1.0) -> float:
+        if not self.enabled:
+            return 0.0
+        if cost > self.burst:
+            self._limited += 1
+            rate_limited.inc()
+            return math.inf
+        now = time.monotonic()
+        tokens, updated = self._buckets.pop(client, (self.burst, now))
+        tokens = min(self.burst, tokens + (now - updated) * self.rate)
+        if tokens >= cost:
+            tokens -= cost
+            wait = 0.0
+            self._allowed += 1
+        else:
+            wait = (cost - tokens) / self.rate
+            self._limited += 1
+            rate_limited.inc()
+        self._buckets[client] = (tokens, now)
+        while len(self._buckets) > self.max_clients:
+            self._buckets.popitem(last=False)
+        return wait
+
+    def stats(self) -> RateLimiterStatsDict:
+        return {
+            "enabled": self.enabled,
+            "clients": len(self._buckets),
+            "allowed": self._allowed,
+            "limited": self._limited,
+        }
+
+
+rate_limiter = RateLimiter()
@@ -0,0 +1,318 @@
+import argparse
+import asyncio
+import json
+import os
+import sqlite3
+import sys
+import time
+from typing import IO, TypedDict, cast
+
+from http_client import close_client
+from journal import JOURNAL_PATH, connect
+from lendasat import (
+    FAILED_SWAP_STATUSES,
+    PAID_SWAP_STATUSES,
+    LendasatResponse,
+    get_swap,
+)
+from rozo import (
+    COMPLETED_PAYMENT_STATUSES,
+    FAILED_PAYMENT_STATUSES,
+    PaymentApiResponseDict,
+    get_payment,
+)
+
+RECONCILE_BATCH_SIZE = int(os.getenv("RECONCILE_BATCH_SIZE", "100"))
+RECONCILE_CONCURRENCY = int(os.getenv("RECONCILE_CONCURRENCY", "8"))
+RECONCILE_REPORT_PATH = os.getenv("RECONCILE_REPORT_PATH", "reconciliation.jsonl")
+
+OPEN_STATES = ("pending", "undelivered", "error")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS reconciliation (
+    swap_id TEXT PRIMARY KEY,
+    seq INTEGER NOT NULL,
+    state TEXT NOT NULL,
+    issue TEXT,
+    swap_status TEXT,
+    payment_status TEXT,
+    checked_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS reconciliation_state ON reconciliation (state, seq);
+CREATE TABLE IF NOT EXISTS reconciliation_checkpoint (
+    id INTEGER PRIMARY KEY CHECK (id = 1),
+    seq INTEGER NOT NULL,
+    updated_at REAL NOT NULL
+);
+"""
+
+SWAP_COLUMNS = ", ".join(
+    f"s.{column}"
+    for column in (
+        "seq",
+        "swap_id",
+        "hash_lock",
+        "rozo_payment_id",
+        "receiving_address",
+        "service",
+        "usd_amount",
+        "sats",
+        "created_at",
+    )
+)
+
+
+class JournalRowDict(TypedDict):
+    seq: int
+    swap_id: str
+    hash_lock: str
+    rozo_payment_id: str
+    receiving_address: str
+    service: str
+    usd_amount: float
+    sats: int
+    created_at: float
+    state: str | None
+
+
+class ReconciliationDict(TypedDict):
+    seq: int
+    swap_id: str
+    rozo_payment_id: str
+    receiving_address: str
+    hash_lock: str
+    service: str
+    usd_amount: float
+    sats: int
+    created_at: float
+    swap_status: str | None
+    payment_status: str | None
+    state: str
+    previous_state: str | None
+    issue: str | None
+    checked_at: float
+
+
+class ReconcileSummaryDict(TypedDict):
+    checked: int
+    changed: int
+    checkpoint: int
+    states: dict[str, int]
+
+
+def _address(value: str | None) -> str | None:
+    return value.lower() if value else None
+
+
+def classify(
+    row: JournalRowDict,
+    swap: LendasatResponse,
+    payment: PaymentApiResponseDict | None,
+) -> tuple[str, str | None]:
+    swap_status = swap.get("status")
+    payment_status = payment["status"] if payment is not None else None
+    if swap.get("hash_lock", row["hash_lock"]) != row["hash_lock"]:
+        return "mismatch", "Lendasat hash lock differs from the journal"
+    swap_address = _address(swap.get("polygon_address"))
+    if swap_address and swap_address != _address(row["receiving_address"]):
+        return "mismatch", "Lendasat pays a different address than the journal"
+    if payment is not None:
+        payment_address = _address(payment.get("metadata", {}).get("receivingAddress"))
+        if payment_address and payment_address != _address(row["receiving_address"]):
+            return "mismatch", "Rozo receiving address differs from the journal"
+    paid = swap_status in PAID_SWAP_STATUSES
+    if payment_status in COMPLETED_PAYMENT_STATUSES:
+        if paid:
+            return "settled", None
+        return "paid_elsewhere", f"Rozo payment completed but swap is {swap_status}"
+    if paid and payment_status in FAILED_PAYMENT_STATUSES:
+        return "bounced", f"Swap {swap_status} but Rozo payment {payment_status}"
+    if paid:
+        return "undelivered", f"Swap {swap_status} but Rozo payment {payment_status}"
+    if swap_status in FAILED_SWAP_STATUSES:
+        return "unpaid", None
+    return "pending", None
+
+
+async def fetch_payment(payment_id: str) -> PaymentApiResponseDict | None:
+    return await get_payment(payment_id) if payment_id else None
+
+
+async def check(row: JournalRowDict) -> ReconciliationDict:
+    swap_status = payment_status = None
+    try:
+        swap, payment = await asyncio.gather(
+            get_swap(row["swap_id"]), fetch_payment(row["rozo_payment_id"])
+        )
+        swap_status = swap.get("status")
+        payment_status = payment["status"] if payment is not None else None
+        state, issue = classify(row, swap, payment)
+    except Exception as e:
+        state, issue = "error", f"{type(e).__name__}: {e}"
+    return {
+        "seq": row["seq"],
+        "swap_id": row["swap_id"],
+        "rozo_payment_id": row["rozo_payment_id"],
+        "receiving_address": row["receiving_address"],
+        "hash_lock": row["hash_lock"],
+        "service": row["service"],
+        "usd_amount": row["usd_amount"],
+        "sats": row["sats"],
+        "created_at": row["created_at"],
+        "swap_status": swap_status,
+        "payment_status": payment_status,
+        "state": state,
+        "previous_state": row["state"],
+        "issue": issue,
+        "checked_at": time.time(),
+    }
+
+
+def load_checkpoint(conn: sqlite3.Connection) -> int:
+    row = conn.execute("SELECT seq FROM reconciliation_checkpoint").fetchone()
+    return row["seq"] if row is not None else 0
+
+
+def save_checkpoint(conn: sqlite3.Connection, seq: int) -> None:
+    conn.execute(
+        "INSERT INTO reconciliation_checkpoint (id, seq, updated_at) "
+        "VALUES (1, ?, ?) "
+        "ON CONFLICT (id) DO UPDATE SET seq = excluded.seq, "
+        "updated_at = excluded.updated_at",
+        (seq, time.time()),
+    )
+
+
+def open_batch(
+    conn: sqlite3.Connection, after: int, limit: int
+) -> list[JournalRowDict]:
+    rows = conn.execute(
+        f"SELECT {SWAP_COLUMNS}, r.state FROM reconciliation r "
+        "JOIN swaps s USING (swap_id) "
+        f"WHERE r.state IN ({', '.join('?' * len(OPEN_STATES))}) AND r.seq > ? "
+        "ORDER BY r.seq LIMIT ?",
+        (*OPEN_STATES, after, limit),
+    )
+    return cast(list[JournalRowDict], [dict(row) for row in rows])
+
+
+def new_batch(conn: sqlite3.Connection, after: int, limit: int) -> list[JournalRowDict]:
+    rows = conn.execute(
+        f"SELECT {SWAP_COLUMNS}, NULL AS state FROM swaps s "
+        "WHERE s.seq > ? ORDER BY s.seq LIMIT ?",
+        (after, limit),
+    )
+    return cast(list[JournalRowDict], [dict(row) for row in rows])
+
+
+class Reconciler:
+    def __init__(
+        self,
+        conn: sqlite3.Connection,
+        report: IO[str],
+        batch_size: int = RECONCILE_BATCH_SIZE,
+        concurrency: int = RECONCILE_CONCURRENCY,
+    ) -> None:
+        self.conn = conn
+        self.report = report
+        self.batch_size = batch_size
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._checked = 0
+        self._changed = 0
+
+    async def _check(self, row: JournalRowDict) -> ReconciliationDict:
+        async with self._semaphore:
+            return await check(row)
+
+    async def process(
+        self, batch: list[JournalRowDict], advance_checkpoint: bool
+    ) -> None:
+        results = await asyncio.gather(*(self._check(row) for row in batch))
+        for result in results:
+            if result["state"] != result["previous_state"]:
+                self.report.write(json.dumps(result) + "\n")
+                self._changed += 1
+        self.report.flush()
+        with self.conn:
+            self.conn.executemany(
+                "INSERT INTO reconciliation "
+                "(swap_id, seq, state, issue, swap_status, payment_status, checked_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT (swap_id) DO UPDATE SET state = excluded.state, "
+                "issue = excluded.issue, swap_status = excluded.swap_status, "
+                "payment_status = excluded.payment_status, "
+                "checked_at = excluded.checked_at",
+                [
+                    (
+                        r["swap_id"],
+                        r["seq"],
+                        r["state"],
+                        r["issue"],
+                        r["swap_status"],
+                        r["payment_status"],
+                        r["checked_at"],
+                    )
+                    for r in results
+                ],
+            )
+            if advance_checkpoint:
+                save_checkpoint(self.conn, batch[-1]["seq"])
+        self._checked += len(results)
+
+    async def run(self) -> ReconcileSummaryDict:
+        after = 0
+        while batch := open_batch(self.conn, after, self.batch_size):
+            await self.process(batch, advance_checkpoint=False)
+            after = batch[-1]["seq"]
+        after = load_checkpoint(self.conn)
+        while batch := new_batch(self.conn, after, self.batch_size):
+            await self.process(batch, advance_checkpoint=True)
+            after = batch[-1]["seq"]
+        return self.summary()
+
+    def summary(self) -> ReconcileSummaryDict:
+        states = self.conn.execute(
+            "SELECT state, COUNT(*) AS n FROM reconciliation GROUP BY state"
+        )
+        return {
+            "checked": self._checked,
+            "changed": self._changed,
+            "checkpoint": load_checkpoint(self.conn),
+            "states": {row["state"]: row["n"] for row in states},
+        }
+
+
+async def run(args: argparse.Namespace) -> ReconcileSummaryDict:
+    conn = connect(args.journal)
+    conn.executescript(SCHEMA)
+    if args.full:
+        with conn:
+            conn.execute("DELETE FROM reconciliation")
+            conn.execute("DELETE FROM reconciliation_checkpoint")
+    try:
+        with open(args.report, "a", encoding="utf-8") as report:
+            reconciler = Reconciler(conn, report, args.batch_size, args.concurrency)
+            return await reconciler.run()
+    finally:
+        await close_client()
+        conn.close()
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="Match journaled Lendasat swaps with their Rozo payments and "
+        "report swaps that were paid but never delivered"
+    )
+    parser.add_argument("--journal", default=JOURNAL_PATH)
+    parser.add_argument("--report", default=RECONCILE_REPORT_PATH)
+    parser.add_argument("--batch-size", type=int, default=RECONCILE_BATCH_SIZE)
+    parser.add_argument("-c", "--concurrency", type=int, default=RECONCILE_CONCURRENCY)
+    parser.add_argument(
+        "--full", action="store_true", help="Forget the checkpoint and recheck all"
+    )
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    summary = asyncio.run(run(parse_args()))
+    print(json.dumps(summary), file=sys.stderr)
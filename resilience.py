@@ -0,0 +1,345 @@
+import asyncio
+import math
+import os
+import random
+import time
+from collections import deque
+from collections.abc import AsyncIterator, Awaitable, Callable
+from contextlib import asynccontextmanager
+from typing import Literal, TypedDict
+
+import httpx
+
+from deadline import DeadlineExceededError, remaining
+from metrics import Counter
+from tracing import tracer
+
+UPSTREAM_RETRIES = int(os.getenv("UPSTREAM_RETRIES", "2"))
+UPSTREAM_BACKOFF_BASE = float(os.getenv("UPSTREAM_BACKOFF_BASE", "0.1"))
+UPSTREAM_BACKOFF_MAX = float(os.getenv("UPSTREAM_BACKOFF_MAX", "1.0"))
+BREAKER_FAILURE_THRESHOLD = int(os.getenv("BREAKER_FAILURE_THRESHOLD", "5"))
+BREAKER_RESET_TIMEOUT = float(os.getenv("BREAKER_RESET_TIMEOUT", "30"))
+HEDGE_ENABLED = os.getenv("UPSTREAM_HEDGE", "1") == "1"
+HEDGE_MIN_DELAY = float(os.getenv("UPSTREAM_HEDGE_MIN_DELAY", "0.05"))
+HEDGE_MIN_SAMPLES = 20
+UPSTREAM_CONCURRENCY = int(os.getenv("UPSTREAM_CONCURRENCY", "32"))
+UPSTREAM_QUEUE_SIZE = int(os.getenv("UPSTREAM_QUEUE_SIZE", "64"))
+UPSTREAM_QUEUE_TIMEOUT = float(os.getenv("UPSTREAM_QUEUE_TIMEOUT", "2"))
+
+RETRYABLE_STATUS_CODES = {429, 502, 503, 504}
+NOT_SENT_ERRORS = (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout)
+TRANSIENT_ERRORS = (httpx.TransportError,)
+
+BreakerState = Literal["closed", "open", "half_open"]
+Admission = Literal["admitted", "queue_full", "queue_timeout"]
+
+UPSTREAMS: dict[str, "Upstream"] = {}
+
+
+upstream_rejections = Counter(
+    "upstream_rejections_total",
+    "Upstream calls rejected before being sent",
+    ("upstream", "reason"),
+)
+
+
+def _setting(name: str, key: str, default: str) -> str:
+    return os.getenv(f"{name.upper()}_{key}", default)
+
+
+class UpstreamUnavailableError(Exception):
+    def __init__(self, upstream: str, retry_after: float, reason: str) -> None:
+        super().__init__(
+            f"{upstream} is {reason}, retry in {max(math.ceil(retry_after), 1)}s"
+        )
+        self.upstream = upstream
+        self.retry_after = retry_after
+
+
+class CircuitOpenError(UpstreamUnavailableError):
+    def __init__(self, upstream: str, retry_after: float) -> None:
+        super().__init__(upstream, retry_after, "unavailable")
+
+
+class UpstreamOverloadedError(UpstreamUnavailableError):
+    def __init__(self, upstream: str, retry_after: float) -> None:
+        super().__init__(upstream, retry_after, "overloaded")
+
+
+class UpstreamStatsDict(TypedDict):
+    state: BreakerState
+    consecutive_failures: int
+    calls: int
+    failures: int
+    retries: int
+    short_circuited: int
+    hedges: int
+    hedge_wins: int
+    p95_ms: float | None
+    active: int
+    queued: int
+    rejected: int
+
+
+class CircuitBreaker:
+    def __init__(
+        self,
+        failure_threshold: int = BREAKER_FAILURE_THRESHOLD,
+        reset_timeout: float = BREAKER_RESET_TIMEOUT,
+    ) -> None:
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state: BreakerState = "closed"
+        self.consecutive_failures = 0
+        self._opened_at = 0.0
+        self._trial_started: float | None = None
+
+    def retry_after(self) -> float:
+        return max(self._opened_at + self.reset_timeout - time.monotonic(), 0.0)
+
+    def allow(self) -> bool:
+        now = time.monotonic()
+        if self.state == "open" and self.retry_after() == 0:
+            self.state = "half_open"
+            self._trial_started = None
+        if self.state == "half_open":
+            if (
+                self._trial_started is not None
+                and now - self._trial_started < self.reset_timeout
+            ):
+                return False
+            self._trial_started = now
+            return True
+        return self.state == "closed"
+
+    def record_success(self) -> None:
+        self.state = "closed"
+        self.consecutive_failures = 0
+        self._trial_started = None
+
+    def record_failure(self) -> None:
+        self.consecutive_failures += 1
+        self._trial_started = None
+        if (
+            self.state == "half_open"
+            or self.consecutive_failures >= self.failure_threshold
+        ):
+            self.state = "open"
+            self._opened_at = time.monotonic()
+
+
+class Bulkhead:
+    def __init__(self, limit: int, queue_size: int, queue_timeout: float) -> None:
+        self.limit = limit
+        self.queue_size = queue_size
+        self.queue_timeout = queue_timeout
+        self.active = 0
+        self._waiters: deque[asyncio.Future[None]] = deque()
+
+    @property
+    def queued(self) -> int:
+        return len(self._waiters)
+
+    async def acquire(self) -> Admission:
+        if self.active < self.limit and not self._waiters:
+            self.active += 1
+            return "admitted"
+        if len(self._waiters) >= self.queue_size:
+            return "queue_full"
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        try:
+            await asyncio.wait_for(waiter, self.queue_timeout)
+        except BaseException as e:
+            if waiter.done() and not waiter.cancelled():
+                self.release()
+            elif waiter in self._waiters:
+                self._waiters.remove(waiter)
+            if isinstance(e, TimeoutError):
+                return "queue_timeout"
+            raise
+        return "admitted"
+
+    def release(self) -> None:
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self.active -= 1
+
+
+class Upstream:
+    def __init__(
+        self,
+        name: str,
+        retries: int = UPSTREAM_RETRIES,
+        breaker: CircuitBreaker | None = None,
+        hedge: bool = HEDGE_ENABLED,
+        bulkhead: Bulkhead | None = None,
+    ) -> None:
+        self.name = name
+        self.retries = retries
+        self.breaker = breaker or CircuitBreaker()
+        self.hedge = hedge
+        self.bulkhead = bulkhead or Bulkhead(
+            int(_setting(name, "CONCURRENCY", str(UPSTREAM_CONCURRENCY))),
+            int(_setting(name, "QUEUE_SIZE", str(UPSTREAM_QUEUE_SIZE))),
+            float(_setting(name, "QUEUE_TIMEOUT", str(UPSTREAM_QUEUE_TIMEOUT))),
+        )
+        self._latencies: deque[float] = deque(maxlen=200)
+        self._calls = 0
+        self._failures = 0
+        self._retries = 0
+        self._short_circuited = 0
+        self._hedges = 0
+        self._hedge_wins = 0
+        self._rejected = 0
+        UPSTREAMS[name] = self
+
+    def p95(self) -> float | None:
+        if len(self._latencies) < HEDGE_MIN_SAMPLES:
+            return None
+        ordered = sorted(self._latencies)
+        return ordered[int(len(ordered) * 0.95) - 1]
+
+    def ensure_available(self) -> None:
+        if self.breaker.state == "open" and self.breaker.retry_after() > 0:
+            self._short_circuited += 1
+            upstream_rejections.inc(self.name, "circuit_open")
+            raise CircuitOpenError(self.name, self.breaker.retry_after())
+
+    @asynccontextmanager
+    async def _admitted(self) -> AsyncIterator[None]:
+        self.ensure_available()
+        admission = await self.bulkhead.acquire()
+        if admission != "admitted":
+            self._rejected += 1
+            upstream_rejections.inc(self.name, admission)
+            raise UpstreamOverloadedError(self.name, self.bulkhead.queue_timeout)
+        try:
+            yield
+        finally:
+            self.bulkhead.release()
+
+    async def call(
+        self,
+        send: Callable[[], Awaitable[httpx.Response]],
+        idempotent: bool = False,
+    ) -> httpx.Response:
+        left = remaining()
+        if left is not None and left <= 0:
+            raise DeadlineExceededError(self.name)
+        self._calls += 1
+        with tracer.span(f"{self.name}.upstream") as span:
+            start = time.perf_counter()
+            async with self._admitted():
+                span["queued_ms"] = round((time.perf_counter() - start) * 1000, 3)
+                return await self._call(send, idempotent)
+
+    async def _call(
+        self,
+        send: Callable[[], Awaitable[httpx.Response]],
+        idempotent: bool,
+    ) -> httpx.Response:
+        attempt = 0
+        while True:
+            if not self.breaker.allow():
+                self._short_circuited += 1
+                raise CircuitOpenError(self.name, self.breaker.retry_after())
+            try:
+                response = await self._send(send, idempotent)
+            except TRANSIENT_ERRORS as e:
+                self._failures += 1
+                self.breaker.record_failure()
+                retryable = isinstance(e, NOT_SENT_ERRORS) or idempotent
+                if not retryable or attempt >= self.retries:
+                    raise
+            else:
+                if response.status_code < 500:
+                    self.breaker.record_success()
+                    if response.status_code != 429:
+                        return response
+                else:
+                    self._failures += 1
+                    self.breaker.record_failure()
+                if (
+                    response.status_code not in RETRYABLE_STATUS_CODES
+                    or not (idempotent or response.status_code == 429)
+                    or attempt >= self.retries
+                ):
+                    return response
+            attempt += 1
+            delay = random.uniform(
+                0, min(UPSTREAM_BACKOFF_MAX, UPSTREAM_BACKOFF_BASE * 2**attempt)
+            )
+            left = remaining()
+            if left is not None and delay >= left:
+                raise DeadlineExceededError(self.name)
+            self._retries += 1
+            await asyncio.sleep(delay)
+
+    async def _timed(
+        self, send: Callable[[], Awaitable[httpx.Response]], hedge: bool = False
+    ) -> httpx.Response:
+        with tracer.span(f"{self.name}.http", hedge=hedge) as span:
+            start = time.perf_counter()
+            response = await send()
+            span["method"] = response.request.method
+            span["path"] = response.request.url.path
+            span["status_code"] = response.status_code
+        if response.status_code < 500:
+            self._latencies.append(time.perf_counter() - start)
+        return response
+
+    async def _send(
+        self, send: Callable[[], Awaitable[httpx.Response]], idempotent: bool
+    ) -> httpx.Response:
+        p95 = self.p95() if self.hedge and idempotent else None
+        if p95 is None:
+            return await self._timed(send)
+        first = asyncio.ensure_future(self._timed(send))
+        tasks = {first}
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=max(p95, HEDGE_MIN_DELAY))
+            if done:
+                return first.result()
+            self._hedges += 1
+            second = asyncio.ensure_future(self._timed(send, hedge=True))
+            tasks.add(second)
+            done, pending = await asyncio.wait(
+                tasks, return_when=asyncio.FIRST_COMPLETED
+            )
+            winner = next((t for t in done if t.exception() is None), None)
+            if winner is None and pending:
+                done, _ = await asyncio.wait(pending)
+                winner = next(iter(done))
+            elif winner is None:
+                winner = first
+            if winner is second and winner.exception() is None:
+                self._hedge_wins += 1
+            return winner.result()
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    def stats(self) -> UpstreamStatsDict:
+        p95 = self.p95()
+        return {
+            "state": self.breaker.state,
+            "consecutive_failures": self.breaker.consecutive_failures,
+            "calls": self._calls,
+            "failures": self._failures,
+            "retries": self._retries,
+            "short_circuited": self._short_circuited,
+            "hedges": self._hedges,
+            "hedge_wins": self._hedge_wins,
+            "p95_ms": round(p95 * 1000, 1) if p95 is not None else None,
+            "active": self.bulkhead.active,
+            "queued": self.bulkhead.queued,
+            "rejected": self._rejected,
+        }
+
+
+def upstream_stats() -> dict[str, UpstreamStatsDict]:
+    return {name: upstream.stats() for name, upstream in UPSTREAMS.items()}
@@ -0,0 +1,195 @@
+import asyncio
+import os
+import socket
+import sqlite3
+import threading
+import time
+from collections.abc import Awaitable, Callable
+from typing import Generic, TypedDict, TypeVar
+
+V = TypeVar("V")
+
+SHARED_CACHE_PATH = os.getenv("SHARED_CACHE_PATH", "cache.db")
+SHARED_LEASE_TIMEOUT = float(os.getenv("SHARED_LEASE_TIMEOUT", "10"))
+SHARED_POLL_INTERVAL = float(os.getenv("SHARED_POLL_INTERVAL", "0.05"))
+SHARED_PRUNE_EVERY = 1000
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    key TEXT PRIMARY KEY,
+    value BLOB NOT NULL,
+    stored_at REAL NOT NULL,
+    expires_at REAL
+);
+CREATE TABLE IF NOT EXISTS leases (
+    key TEXT PRIMARY KEY,
+    owner TEXT NOT NULL,
+    expires_at REAL NOT NULL
+);
+"""
+
+
+class SharedStoreStatsDict(TypedDict):
+    reads: int
+    hits: int
+    writes: int
+    leases_won: int
+    leases_lost: int
+
+
+class SharedStore:
+    def __init__(self, path: str = SHARED_CACHE_PATH) -> None:
+        self.path = path
+        self.owner = f"{socket.gethostname()}:{os.getpid()}"
+        self._conn: sqlite3.Connection | None = None
+        self._lock = threading.Lock()
+        self._reads = 0
+        self._hits = 0
+        self._writes = 0
+        self._leases_won = 0
+        self._leases_lost = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self._conn is not None
+
+    def open(self) -> None:
+        if self._conn is not None or not self.path:
+            return
+        conn = sqlite3.connect(
+            self.path, check_same_thread=False, isolation_level=None, timeout=5
+        )
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.executescript(SCHEMA)
+        if self.path != ":memory:":
+            os.chmod(self.path, 0o600)
+        self._conn = conn
+
+    def close(self) -> None:
+        if self._conn is not None:
+            with self._lock:
+                self._conn.execute("DELETE FROM leases WHERE owner = ?", (self.owner,))
+                self._conn.close()
+            self._conn = None
+
+    def load(self, key: str) -> tuple[bytes, float] | None:
+        assert self._conn is not None
+        now = time.time()
+        with self._lock:
+            self._reads += 1
+            row = self._conn.execute(
+                "SELECT value, stored_at FROM entries "
+                "WHERE key = ? AND (expires_at IS NULL OR expires_at > ?)",
+                (key, now),
+            ).fetchone()
+        if row is None:
+            return None
+        self._hits += 1
+        return row[0], max(now - row[1], 0.0)
+
+    def store(self, key: str, value: bytes, ttl: float | None = None) -> None:
+        assert self._conn is not None
+        now = time.time()
+        with self._lock:
+            self._writes += 1
+            self._conn.execute(
+                "INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?)",
+                (key, value, now, now + ttl if ttl is not None else None),
+            )
+            if self._writes % SHARED_PRUNE_EVERY == 0:
+                self._conn.execute("DELETE FROM entries WHERE expires_at <= ?", (now,))
+
+    def acquire(self, key: str, timeout: float = SHARED_LEASE_TIMEOUT) -> bool:
+        assert self._conn is not None
+        now = time.time()
+        with self._lock:
+            won = (
+                self._conn.execute(
+                    "INSERT INTO leases VALUES (?, ?, ?) ON CONFLICT (key) DO UPDATE "
+                    "SET owner = excluded.owner, expires_at = excluded.expires_at "
+                    "WHERE leases.expires_at <= ? OR leases.owner = excluded.owner",
+                    (key, self.owner, now + timeout, now),
+                ).rowcount
+                == 1
+            )
+        if won:
+            self._leases_won += 1
+        else:
+            self._leases_lost += 1
+        return won
+
+    def release(self, key: str) -> None:
+        assert self._conn is not None
+        with self._lock:
+            self._conn.execute(
+                "DELETE FROM leases WHERE key = ? AND owner = ?", (key, self.owner)
+            )
+
+    def stats(self) -> SharedStoreStatsDict:
+        return {
+            "reads": self._reads,
+            "hits": self._hits,
+            "writes": self._writes,
+            "leases_won": self._leases_won,
+            "leases_lost": self._leases_lost,
+        }
+
+
+class SharedTier(Generic[V]):
+    def __init__(
+        self,
+        store: SharedStore,
+        namespace: str,
+        encode: Callable[[V], bytes],
+        decode: Callable[[bytes], V],
+    ) -> None:
+        self.store = store
+        self.namespace = namespace
+        self.encode = encode
+        self.decode = decode
+
+    async def get(self, key: str, max_age: float | None = None) -> V | None:
+        if not self.store.enabled:
+            return None
+        entry = await asyncio.to_thread(self.store.load, f"{self.namespace}:{key}")
+        if entry is None or (max_age is not None and entry[1] >= max_age):
+            return None
+        return self.decode(entry[0])
+
+    async def put(self, key: str, value: V, ttl: float | None = None) -> None:
+        if self.store.enabled:
+            await asyncio.to_thread(
+                self.store.store, f"{self.namespace}:{key}", self.encode(value), ttl
+            )
+
+    async def load(
+        self,
+        key: str,
+        max_age: float,
+        loader: Callable[[], Awaitable[V]],
+        ttl: float | None = None,
+        lease_timeout: float = SHARED_LEASE_TIMEOUT,
+    ) -> tuple[V, float]:
+        if not self.store.enabled:
+            return await loader(), 0.0
+        name = f"{self.namespace}:{key}"
+        deadline = time.monotonic() + lease_timeout
+        while True:
+            entry = await asyncio.to_thread(self.store.load, name)
+            if entry is not None and entry[1] < max_age:
+                return self.decode(entry[0]), entry[1]
+            leased = await asyncio.to_thread(self.store.acquire, name, lease_timeout)
+            if leased or time.monotonic() >= deadline:
+                break
+            await asyncio.sleep(SHARED_POLL_INTERVAL)
+        try:
+            value = await loader()
+            await asyncio.to_thread(self.store.store, name, self.encode(value), ttl)
+        finally:
+            if leased:
+                await asyncio.to_thread(self.store.release, name)
+        return value, 0.0
+
+
+shared_store = SharedStore()
@@ -0,0 +1,71 @@
+import gzip
+import hashlib
+
+from fastapi import Request
+from fastapi.responses import Response
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+def etag_matches(request: Request, *etags: str) -> bool:
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is None:
+        return False
+    candidates = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+    return "*" in candidates or any(etag in candidates for etag in etags)
+
+
+def accepted_encodings(request: Request) -> set[str]:
+    accepted = set()
+    for part in request.headers.get("accept-encoding", "").split(","):
+        coding, _, params = part.strip().partition(";")
+        q = params.strip().removeprefix("q=")
+        try:
+            if q and float(q) == 0:
+                continue
+        except ValueError:
+            continue
+        accepted.add(coding.strip().lower())
+    return accepted
+
+
+class StaticAsset:
+    def __init__(
+        self, body: bytes, media_type: str, cache_control: str = "no-cache"
+    ) -> None:
+        self.media_type = media_type
+        self.cache_control = cache_control
+        digest = hashlib.sha256(body).hexdigest()[:32]
+        self.variants: dict[str, bytes] = {"identity": body}
+        if brotli is not None:
+            self.variants["br"] = brotli.compress(body, quality=11)
+        self.variants["gzip"] = gzip.compress(body, compresslevel=9, mtime=0)
+        self.etags = {
+            coding: f'"{digest}"' if coding == "identity" else f'"{digest}-{coding}"'
+            for coding in self.variants
+        }
+
+    def negotiate(self, request: Request) -> str:
+        accepted = accepted_encodings(request)
+        for coding in ("br", "gzip"):
+            if coding in self.variants and (coding in accepted or "*" in accepted):
+                return coding
+        return "identity"
+
+    def response(self, request: Request) -> Response:
+        coding = self.negotiate(request)
+        headers = {
+            "ETag": self.etags[coding],
+            "Cache-Control": self.cache_control,
+            "Vary": "Accept-Encoding",
+        }
+        if coding != "identity":
+            headers["Content-Encoding"] = coding
+        if etag_matches(request, self.etags[coding]):
+            return Response(status_code=304, headers=headers)
+        return Response(
+            self.variants[coding], media_type=self.media_type, headers=headers
+        )
@@ -0,0 +1,307 @@
+import asyncio
+import json
+import logging
+import os
+import queue
+import random
+import threading
+import time
+from collections import deque
+from collections.abc import Iterator
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import IO, Any, TypedDict
+
+logger = logging.getLogger(__name__)
+
+TRACE_BUFFER_SIZE = int(os.getenv("TRACE_BUFFER_SIZE", "256"))
+TRACE_MAX_SPANS = int(os.getenv("TRACE_MAX_SPANS", "64"))
+TRACE_EXPORT_PATH = os.getenv("TRACE_EXPORT_PATH", "")
+TRACE_EXPORT_QUEUE_SIZE = int(os.getenv("TRACE_EXPORT_QUEUE_SIZE", "1024"))
+SERVICE_NAME = os.getenv("OTEL_SERVICE_NAME", "ns-bitcoin-payments")
+
+AttributeValue = str | int | float | bool
+
+
+class SpanDict(TypedDict):
+    span_id: str
+    parent_id: str | None
+    name: str
+    start_ns: int
+    offset_ms: float
+    duration_ms: float
+    status: str
+    error: str | None
+    attributes: dict[str, AttributeValue]
+
+
+class TraceDict(TypedDict):
+    trace_id: str
+    name: str
+    start_ns: int
+    duration_ms: float
+    status: str
+    dropped_spans: int
+    spans: list[SpanDict]
+
+
+class TracingStatsDict(TypedDict):
+    enabled: bool
+    buffered: int
+    capacity: int
+    recorded: int
+    exported: int
+    export_pending: int
+    export_dropped: int
+
+
+_current: ContextVar[tuple[TraceDict, str | None] | None] = ContextVar(
+    "current_span", default=None
+)
+
+
+def _id(bits: int) -> str:
+    return f"{random.getrandbits(bits):0{bits // 4}x}"
+
+
+class Tracer:
+    def __init__(
+        self,
+        capacity: int = TRACE_BUFFER_SIZE,
+        max_spans: int = TRACE_MAX_SPANS,
+        export_path: str = TRACE_EXPORT_PATH,
+        export_queue_size: int = TRACE_EXPORT_QUEUE_SIZE,
+    ) -> None:
+        self.capacity = capacity
+        self.max_spans = max_spans
+        self.export_path = export_path
+        self._traces: deque[TraceDict] = deque(maxlen=max(capacity, 1))
+        self._queue: queue.Queue[TraceDict | None] = queue.Queue(export_queue_size)
+        self._thread: threading.Thread | None = None
+        self._active: set[str] = set()
+        self._recorded = 0
+        self._exported = 0
+        self._export_dropped = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.capacity > 0
+
+    @contextmanager
+    def span(
+        self, name: str, **attributes: AttributeValue
+    ) -> Iterator[dict[str, AttributeValue]]:
+        current = _current.get()
+        if current is None:
+            yield attributes
+            return
+        trace, parent_id = current
+        record: SpanDict = {
+            "span_id": _id(64),
+            "parent_id": parent_id,
+            "name": name,
+            "start_ns": time.time_ns(),
+            "offset_ms": 0.0,
+            "duration_ms": 0.0,
+            "status": "ok",
+            "error": None,
+            "attributes": attributes,
+        }
+        record["offset_ms"] = round((record["start_ns"] - trace["start_ns"]) / 1e6, 3)
+        token = _current.set((trace, record["span_id"]))
+        start = time.perf_counter()
+        try:
+            yield attributes
+        except asyncio.CancelledError:
+            record["status"] = "cancelled"
+            raise
+        except BaseException as e:
+            record["status"] = "error"
+            record["error"] = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            record["duration_ms"] = round((time.perf_counter() - start) * 1000, 3)
+            _current.reset(token)
+            if trace["trace_id"] in self._active:
+                if len(trace["spans"]) < self.max_spans or parent_id is None:
+                    trace["spans"].append(record)
+                else:
+                    trace["dropped_spans"] += 1
+
+    @contextmanager
+    def trace(
+        self, name: str, **attributes: AttributeValue
+    ) -> Iterator[dict[str, AttributeValue]]:
+        if not self.enabled or _current.get() is not None:
+            with self.span(name, **attributes) as span_attributes:
+                yield span_attributes
+            return
+        record: TraceDict = {
+            "trace_id": _id(128),
+            "name": name,
+            "start_ns": time.time_ns(),
+            "duration_ms": 0.0,
+            "status": "ok",
+            "dropped_spans": 0,
+            "spans": [],
+        }
+        token = _current.set((record, None))
+        self._active.add(record["trace_id"])
+        try:
+            with self.span(name, **attributes) as span_attributes:
+                yield span_attributes
+        finally:
+            _current.reset(token)
+            self._finish(record)
+            self._active.discard(record["trace_id"])
+
+    def _finish(self, record: TraceDict) -> None:
+        root = next(s for s in record["spans"] if s["parent_id"] is None)
+        record["start_ns"] = root["start_ns"]
+        record["duration_ms"] = root["duration_ms"]
+        record["status"] = root["status"]
+        record["spans"].sort(key=lambda s: s["start_ns"])
+        self._traces.append(record)
+        self._recorded += 1
+        if self.export_path:
+            self._export(record)
+
+    def _export(self, record: TraceDict) -> None:
+        if self._thread is None:
+            self._thread = threading.Thread(
+                target=self._run,
+                args=(self.export_path,),
+                name="trace-export",
+                daemon=True,
+            )
+            self._thread.start()
+        try:
+            self._queue.put_nowait(record)
+        except queue.Full:
+            self._export_dropped += 1
+
+    def _next_batch(self) -> tuple[list[TraceDict], bool]:
+        first = self._queue.get()
+        if first is None:
+            return [], True
+        batch = [first]
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                return batch, False
+            if item is None:
+                return batch, True
+            batch.append(item)
+
+    def _run(self, path: str) -> None:
+        try:
+            export: IO[str] | None = open(path, "a", encoding="utf-8")
+        except OSError:
+            logger.exception("Cannot open trace export file %s", path)
+            export = None
+        closing = False
+        while not closing:
+            batch, closing = self._next_batch()
+            if not batch:
+                continue
+            if export is None:
+                self._export_dropped += len(batch)
+                continue
+            try:
+                export.writelines(
+                    json.dumps(otlp_json(record), separators=(",", ":")) + "\n"
+                    for record in batch
+                )
+                export.flush()
+            except Exception:
+                logger.exception("Trace export to %s failed", path)
+                self._export_dropped += len(batch)
+                continue
+            self._exported += len(batch)
+        if export is not None:
+            export.close()
+
+    def close(self) -> None:
+        if self._thread is None:
+            return
+        self._queue.put(None)
+        self._thread.join()
+        self._thread = None
+
+    def slowest(self, limit: int = 20, name: str | None = None) -> list[TraceDict]:
+        traces = [t for t in self._traces if name is None or t["name"] == name]
+        traces.sort(key=lambda t: t["duration_ms"], reverse=True)
+        return traces[:limit]
+
+    def stats(self) -> TracingStatsDict:
+        return {
+            "enabled": self.enabled,
+            "buffered": len(self._traces) if self.enabled else 0,
+            "capacity": self.capacity,
+            "recorded": self._recorded,
+            "exported": self._exported,
+            "export_pending": self._queue.qsize(),
+            "export_dropped": self._export_dropped,
+        }
+
+
+def _otlp_value(value: AttributeValue) -> dict[str, Any]:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+def _otlp_span(trace_id: str, span: SpanDict) -> dict[str, Any]:
+    status: dict[str, Any] = {"code": 2 if span["status"] == "error" else 0}
+    if span["error"]:
+        status["message"] = span["error"]
+    attributes = dict(span["attributes"])
+    if span["status"] == "cancelled":
+        attributes["cancelled"] = True
+    otlp: dict[str, Any] = {
+        "traceId": trace_id,
+        "spanId": span["span_id"],
+        "name": span["name"],
+        "kind": 1,
+        "startTimeUnixNano": str(span["start_ns"]),
+        "endTimeUnixNano": str(span["start_ns"] + int(span["duration_ms"] * 1e6)),
+        "attributes": [
+            {"key": key, "value": _otlp_value(value)}
+            for key, value in attributes.items()
+        ],
+        "status": status,
+    }
+    if span["parent_id"] is not None:
+        otlp["parentSpanId"] = span["parent_id"]
+    return otlp
+
+
+def otlp_json(record: TraceDict) -> dict[str, Any]:
+    return {
+        "resourceSpans": [
+            {
+                "resource": {
+                    "attributes": [
+                        {"key": "service.name", "value": {"stringValue": SERVICE_NAME}}
+                    ]
+                },
+                "scopeSpans": [
+                    {
+                        "scope": {"name": "tracing"},
+                        "spans": [
+                            _otlp_span(record["trace_id"], span)
+                            for span in record["spans"]
+                        ],
+                    }
+                ],
+            }
+        ]
+    }
+
+
+tracer = Tracer()
@@ -0,0 +1,243 @@
+import asyncio
+import logging
+import os
+import time
+from collections.abc import AsyncIterator
+from typing import Literal, TypedDict
+
+from lendasat import FAILED_SWAP_STATUSES, PAID_SWAP_STATUSES, get_swap
+from rozo import COMPLETED_PAYMENT_STATUSES, FAILED_PAYMENT_STATUSES, get_payment
+
+logger = logging.getLogger(__name__)
+
+STATUS_POLL_INTERVAL = float(os.getenv("STATUS_POLL_INTERVAL", "3"))
+STATUS_IDLE_POLL_EVERY = int(os.getenv("STATUS_IDLE_POLL_EVERY", "10"))
+STATUS_POLL_CONCURRENCY = int(os.getenv("STATUS_POLL_CONCURRENCY", "8"))
+STATUS_TRACK_TTL = float(os.getenv("STATUS_TRACK_TTL", "3600"))
+STATUS_HEARTBEAT = float(os.getenv("STATUS_HEARTBEAT", "15"))
+
+InvoiceState = Literal["pending", "paid", "completed", "failed", "expired"]
+FINAL_STATES = {"completed", "failed", "expired"}
+
+
+class InvoiceStatusDict(TypedDict):
+    id: str
+    state: InvoiceState
+    swap_status: str | None
+    payment_status: str | None
+    updated_at: float
+
+
+class TrackerStatsDict(TypedDict):
+    open: int
+    watched: int
+    subscribers: int
+    polls: int
+    upstream_requests: int
+    poll_errors: int
+
+
+def derive_state(swap_status: str | None, payment_status: str | None) -> InvoiceState:
+    if payment_status in COMPLETED_PAYMENT_STATUSES:
+        return "completed"
+    if payment_status in FAILED_PAYMENT_STATUSES:
+        return "failed"
+    if swap_status == "expired":
+        return "expired"
+    if swap_status in FAILED_SWAP_STATUSES:
+        return "failed"
+    if swap_status in PAID_SWAP_STATUSES:
+        return "paid"
+    return "pending"
+
+
+class StatusTracker:
+    def __init__(
+        self,
+        interval: float = STATUS_POLL_INTERVAL,
+        concurrency: int = STATUS_POLL_CONCURRENCY,
+    ) -> None:
+        self.interval = interval
+        self.concurrency = concurrency
+        self._payment_ids: dict[str, str] = {}
+        self._tracked_at: dict[str, float] = {}
+        self._expires_at: dict[str, float] = {}
+        self._expiring: set[str] = set()
+        self._status: dict[str, InvoiceStatusDict] = {}
+        self._subscribers: dict[str, set[asyncio.Queue[InvoiceStatusDict]]] = {}
+        self._poller: asyncio.Task[None] | None = None
+        self._ticks = 0
+        self._polls = 0
+        self._upstream_requests = 0
+        self._poll_errors = 0
+
+    def track(
+        self, swap_id: str, rozo_payment_id: str, expires_at: float | None = None
+    ) -> None:
+        self._payment_ids[swap_id] = rozo_payment_id
+        self._tracked_at[swap_id] = time.monotonic()
+        if expires_at is not None:
+            self._expires_at[swap_id] = expires_at
+        self._status[swap_id] = {
+            "id": swap_id,
+            "state": "pending",
+            "swap_status": None,
+            "payment_status": None,
+            "updated_at": time.time(),
+        }
+
+    def status(self, swap_id: str) -> InvoiceStatusDict | None:
+        return self._status.get(swap_id)
+
+    async def subscribe(
+        self, swap_id: str, rozo_payment_id: str, expires_at: float | None = None
+    ) -> AsyncIterator[InvoiceStatusDict | None]:
+        if swap_id not in self._status:
+            self.track(swap_id, rozo_payment_id, expires_at)
+        status = self._status[swap_id]
+        queue: asyncio.Queue[InvoiceStatusDict] = asyncio.Queue()
+        self._subscribers.setdefault(swap_id, set()).add(queue)
+        try:
+            yield status
+            while status["state"] not in FINAL_STATES:
+                try:
+                    status = await asyncio.wait_for(queue.get(), STATUS_HEARTBEAT)
+                except TimeoutError:
+                    yield None
+                    continue
+                yield status
+        finally:
+            subscribers = self._subscribers.get(swap_id)
+            if subscribers is not None:
+                subscribers.discard(queue)
+                if not subscribers:
+                    del self._subscribers[swap_id]
+                    if swap_id not in self._tracked_at:
+                        self._status.pop(swap_id, None)
+
+    def start(self) -> None:
+        if self._poller is None:
+            self._poller = asyncio.create_task(self._poll_forever())
+
+    async def stop(self) -> None:
+        if self._poller is not None:
+            self._poller.cancel()
+            try:
+                await self._poller
+            except asyncio.CancelledError:
+                pass
+            self._poller = None
+
+    async def _poll_forever(self) -> None:
+        while True:
+            try:
+                await self.poll_once()
+            except Exception:
+                logger.exception("Status poll failed")
+            await asyncio.sleep(self.interval)
+
+    def _due(self) -> list[str]:
+        now = time.monotonic()
+        wall_now = time.time()
+        idle_tick = self._ticks % STATUS_IDLE_POLL_EVERY == 0
+        due = []
+        for swap_id, tracked_at in list(self._tracked_at.items()):
+            state = self._status[swap_id]["state"]
+            if state in FINAL_STATES:
+                self._forget(swap_id)
+            elif now - tracked_at > STATUS_TRACK_TTL:
+                current = self._status[swap_id]
+                self._publish(
+                    swap_id,
+                    current["swap_status"],
+                    current["payment_status"],
+                    "expired",
+                )
+                self._forget(swap_id)
+            elif state == "pending" and wall_now >= self._expires_at.get(
+                swap_id, float("inf")
+            ):
+                self._expiring.add(swap_id)
+                due.append(swap_id)
+            elif swap_id in self._subscribers or idle_tick:
+                due.append(swap_id)
+        return due
+
+    def _forget(self, swap_id: str) -> None:
+        self._tracked_at.pop(swap_id, None)
+        self._payment_ids.pop(swap_id, None)
+        self._expires_at.pop(swap_id, None)
+        self._expiring.discard(swap_id)
+        if swap_id not in self._subscribers:
+            self._status.pop(swap_id, None)
+
+    async def poll_once(self) -> None:
+        self._ticks += 1
+        due = self._due()
+        if not due:
+            return
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def poll(swap_id: str) -> None:
+            async with semaphore:
+                await self._poll(swap_id)
+
+        await asyncio.gather(*(poll(swap_id) for swap_id in due))
+
+    async def _poll(self, swap_id: str) -> None:
+        self._polls += 1
+        current = self._status[swap_id]
+        try:
+            self._upstream_requests += 1
+            swap_status = (await get_swap(swap_id)).get("status")
+            payment_status = current["payment_status"]
+            if swap_status in PAID_SWAP_STATUSES:
+                self._upstream_requests += 1
+                payment = await get_payment(self._payment_ids[swap_id])
+                payment_status = payment["status"]
+        except Exception:
+            self._poll_errors += 1
+            logger.warning("Status poll failed for swap %s", swap_id, exc_info=True)
+            return
+        self._publish(swap_id, swap_status, payment_status)
+        if swap_id in self._expiring and self._status[swap_id]["state"] == "pending":
+            self._publish(swap_id, swap_status, payment_status, "expired")
+
+    def _publish(
+        self,
+        swap_id: str,
+        swap_status: str | None,
+        payment_status: str | None,
+        state: InvoiceState | None = None,
+    ) -> None:
+        current = self._status[swap_id]
+        state = state or derive_state(swap_status, payment_status)
+        if (
+            current["state"] == state
+            and current["swap_status"] == swap_status
+            and current["payment_status"] == payment_status
+        ):
+            return
+        status: InvoiceStatusDict = {
+            "id": swap_id,
+            "state": state,
+            "swap_status": swap_status,
+            "payment_status": payment_status,
+            "updated_at": time.time(),
+        }
+        self._status[swap_id] = status
+        for queue in self._subscribers.get(swap_id, ()):
+            queue.put_nowait(status)
+
+    def stats(self) -> TrackerStatsDict:
+        return {
+            "open": len(self._tracked_at),
+            "watched": len(self._subscribers),
+            "subscribers": sum(len(s) for s in self._subscribers.values()),
+            "polls": self._polls,
+            "upstream_requests": self._upstream_requests,
+            "poll_errors": self._poll_errors,
+        }
+
+
+status_tracker = StatusTracker()